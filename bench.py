@@ -0,0 +1,418 @@
+# Benchmarks hors ligne des chemins chauds du bot.
+# Aucun appel réseau : serveurs, salons, membres et messages sont simulés.
+#
+#   python bench.py            # tailles complètes (jusqu'à 1M warns)
+#   python bench.py --quick    # tailles réduites
+#
+# Les résultats sont écrits en JSON (bench_results.json par défaut) et
+# comparés au fichier précédent s'il existe.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+import main
+
+# ---------------------- OBJETS SIMULÉS ----------------------
+class FakeAsset:
+
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeUser:
+
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.avatar = None
+        self.default_avatar = FakeAsset(
+            f"https://cdn.discordapp.com/embed/avatars/{user_id % 5}.png")
+
+
+class FakeAttachment:
+
+    def __init__(self, url, content_type):
+        self.url = url
+        self.content_type = content_type
+        self.filename = url.rsplit("/", 1)[-1]
+        self.size = 150_000
+
+
+class FakeMessage:
+
+    def __init__(self, message_id, author, content, created_at,
+                 attachments=()):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+        self.attachments = list(attachments)
+
+
+class FakeRole:
+
+    def __init__(self, role_id, name, guild):
+        self.id = role_id
+        self.name = name
+        self.guild = guild
+
+
+class FakeMember(FakeUser):
+
+    def __init__(self, user_id, name, guild, role_ids):
+        super().__init__(user_id, name)
+        self.guild = guild
+        self.role_ids = set(role_ids)
+
+    def get_role(self, role_id):
+        return self.guild.get_role(role_id) if role_id in self.role_ids else None
+
+
+class FakeREST:
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def request(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeChannel:
+
+    def __init__(self, channel_id, name, guild, rest=None, messages=()):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.rest = rest
+        self.messages = list(messages)
+        self.overwrites = {}
+
+    def overwrites_for(self, target):
+        return discord.PermissionOverwrite(
+            **self.overwrites.get(target.id, {}))
+
+    async def set_permissions(self, target, *, overwrite):
+        await self.rest.request()
+        self.overwrites[target.id] = {
+            perm: value
+            for perm, value in overwrite
+            if value is not None
+        }
+
+    async def history(self, limit=None, before=None, oldest_first=None):
+        for message in self.messages:
+            if before is not None and message.id >= before.id:
+                break
+            yield message
+
+
+class FakeGuild:
+
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.roles = []
+        self.channels = []
+        self._roles = {}
+        self._channels = {}
+
+    @property
+    def text_channels(self):
+        return self.channels
+
+    def add_role(self, role):
+        self.roles.append(role)
+        self._roles[role.id] = role
+
+    def add_channel(self, channel):
+        self.channels.append(channel)
+        self._channels[channel.id] = channel
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+
+class FakeInteraction:
+
+    def __init__(self, guild, user):
+        self.guild = guild
+        self.user = user
+
+
+# ---------------------- OUTILS ----------------------
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def per_op(seconds, ops):
+    return {
+        "seconds": round(seconds, 6),
+        "ops": ops,
+        "us_per_op": round(seconds / ops * 1e6, 3) if ops else None
+    }
+
+
+def make_warns(count, per_user=10, guild_id=1):
+    base = datetime(2025, 1, 1)
+    warns = {}
+    for i in range(count):
+        warns.setdefault(str(10**17 + i // per_user), []).append({
+            "reason": f"raison {i}",
+            "moderator": f"modo{i % 20}",
+            "timestamp": (base + timedelta(seconds=i)).isoformat()
+        })
+    return {str(guild_id): warns}
+
+
+def make_messages(count):
+    authors = [FakeUser(10**17 + i, f"membre{i}") for i in range(5)]
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    messages = []
+    for i in range(count):
+        attachments = ([
+            FakeAttachment(f"https://cdn.discordapp.com/a/{i}/screen.png",
+                           "image/png")
+        ] if i % 50 == 0 else [])
+        messages.append(
+            FakeMessage(10**18 + i, authors[i % len(authors)],
+                        f"Message {i}\nLigne <b>deux</b> & suite", base +
+                        timedelta(seconds=i), attachments))
+    return messages
+
+
+# ---------------------- BENCHMARKS ----------------------
+def bench_warns(sizes, workdir):
+    results = {}
+    main.WARNS_FILE = os.path.join(workdir, "warns.json")
+    main.WARNS_JOURNAL = os.path.join(workdir, "warns.journal")
+    for size in sizes:
+        data = make_warns(size)
+        save_s, _ = timed(main.save_warns, data)
+        load_s, _ = timed(main.load_warns)
+        store = main.WarnStore()
+        store_load_s, _ = timed(store.load)
+
+        async def adds():
+            start = time.perf_counter()
+            for i in range(1000):
+                await store.add(1, 10**17 + i, {
+                    "reason": "bench",
+                    "moderator": "bench",
+                    "timestamp": datetime.utcnow().isoformat()
+                })
+            return time.perf_counter() - start
+
+        add_s = asyncio.run(adds())
+        results[str(size)] = {
+            "file_bytes": os.path.getsize(main.WARNS_FILE),
+            "save_warns": per_op(save_s, 1),
+            "load_warns": per_op(load_s, 1),
+            "warn_store_load": per_op(store_load_s, 1),
+            "warn_store_add": per_op(add_s, 1000),
+        }
+        os.remove(main.WARNS_JOURNAL)
+        print(f"  warns {size}: save {save_s:.3f}s, load {load_s:.3f}s, "
+              f"add {add_s / 1000 * 1e6:.1f}us/op")
+    return results
+
+
+def bench_transcript(sizes):
+    results = {}
+    guild = FakeGuild(1)
+    for size in sizes:
+        messages = make_messages(size)
+        channel = FakeChannel(2, "ticket-bench", guild, messages=messages)
+
+        async def render(captured):
+            main.ticket_logs.pop(channel.id, None)
+            if captured:
+                log = main.ticket_logs[channel.id] = main.TicketLog(
+                    complete=True)
+                for message in messages:
+                    log.rows[message.id] = main.message_row(message)
+            start = time.perf_counter()
+            file = await main.generate_transcript(channel)
+            elapsed = time.perf_counter() - start
+            file.fp.seek(0, os.SEEK_END)
+            size_bytes = file.fp.tell()
+            file.fp.close()
+            return elapsed, size_bytes
+
+        history_s, size_bytes = asyncio.run(render(False))
+        captured_s, _ = asyncio.run(render(True))
+        results[str(size)] = {
+            "bytes": size_bytes,
+            "history": per_op(history_s, size),
+            "captured": per_op(captured_s, size),
+        }
+        print(f"  transcript {size}: historique {history_s:.3f}s, "
+              f"capture {captured_s:.3f}s")
+    return results
+
+
+def bench_channels(count=500, lookups=100_000):
+    guild = FakeGuild(1)
+    for i in range(count):
+        guild.add_channel(FakeChannel(1000 + i, f"🟤・salon {i}", guild))
+    target = f"🟤・salon {count - 1}"
+
+    def linear():
+        cleaned = target.lower().replace("・", "").replace(" ", "-")
+        return next((c for c in guild.text_channels
+                     if c.name.lower().replace("・", "").replace(" ", "-") ==
+                     cleaned), None)
+
+    def indexed():
+        for _ in range(lookups):
+            main.get_channel_by_name(guild, target)
+
+    main.channel_index.guilds.pop(guild.id, None)
+    build_s, _ = timed(main.channel_index.build, guild)
+    indexed_s, _ = timed(indexed)
+    linear_s, _ = timed(lambda: [linear() for _ in range(lookups // 100)])
+    print(f"  salons {count}: index {indexed_s / lookups * 1e6:.2f}us, "
+          f"scan {linear_s / (lookups // 100) * 1e6:.2f}us")
+    return {
+        "channels": count,
+        "index_build": per_op(build_s, 1),
+        "indexed_lookup": per_op(indexed_s, lookups),
+        "linear_scan_reference": per_op(linear_s, lookups // 100),
+    }
+
+
+def bench_roles(role_count=200, checks=200_000):
+    guild = FakeGuild(2)
+    groups = main.role_groups(guild)
+    names = list(dict.fromkeys(n for names, _ in groups.values() for n in names))
+    for i in range(role_count):
+        name = names[i] if i < len(names) else f"rôle {i}"
+        guild.add_role(FakeRole(5000 + i, name, guild))
+    member_role_ids = [5000 + i for i in range(len(names), role_count, 10)]
+    allowed = FakeInteraction(
+        guild, FakeMember(1, "modo", guild, member_role_ids + [5000]))
+    denied = FakeInteraction(guild,
+                             FakeMember(2, "membre", guild, member_role_ids))
+    results = {}
+    main.role_index.guilds.pop(guild.id, None)
+    for group in groups:
+
+        def run():
+            for _ in range(checks // 2):
+                main.member_in_group(allowed, group)
+                main.member_in_group(denied, group)
+
+        seconds, _ = timed(run)
+        results[group] = per_op(seconds, checks)
+        print(f"  rôles {group}: {seconds / checks * 1e6:.2f}us/check")
+    return results
+
+
+def bench_mute(count=500, latency=0.002):
+    guild = FakeGuild(3)
+    rest = FakeREST(latency)
+    for i in range(count):
+        guild.add_channel(FakeChannel(2000 + i, f"salon-{i}", guild, rest))
+    role = FakeRole(9000, main.MUTED_ROLE_NAME, guild)
+    guild.add_role(role)
+
+    async def run():
+        start = time.perf_counter()
+        applied = await main.sync_muted_overwrites(guild, role)
+        first = time.perf_counter() - start
+        calls_first = rest.calls
+        start = time.perf_counter()
+        await main.sync_muted_overwrites(guild, role)
+        second = time.perf_counter() - start
+        return first, calls_first, applied, second, rest.calls - calls_first
+
+    first, calls_first, applied, second, calls_second = asyncio.run(run())
+    print(f"  mute {count} salons: 1re synchro {first:.3f}s / {calls_first} "
+          f"appels, 2e {second:.3f}s / {calls_second} appels")
+    return {
+        "channels": count,
+        "simulated_latency": latency,
+        "legacy_calls_per_mute": count,
+        "first_sync": {
+            **per_op(first, 1), "rest_calls": calls_first,
+            "applied": applied
+        },
+        "second_sync": {
+            **per_op(second, 1), "rest_calls": calls_second
+        },
+    }
+
+
+# ---------------------- LANCEMENT ----------------------
+def compare(previous, current, path=""):
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        if isinstance(value, dict):
+            compare(old or {}, value, f"{path}{key}.")
+        elif key == "seconds" and isinstance(old, (int, float)) and old:
+            delta = (value - old) / old * 100
+            if abs(delta) >= 10:
+                print(f"  {path}{key}: {old:.4f}s -> {value:.4f}s "
+                      f"({delta:+.0f}%)")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Benchmarks hors ligne")
+    parser.add_argument("--quick", action="store_true",
+                        help="tailles réduites")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+    warn_sizes = [10_000] if args.quick else [10_000, 100_000, 1_000_000]
+    transcript_sizes = [1_000] if args.quick else [1_000, 10_000, 100_000]
+
+    results = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "discord.py": discord.__version__,
+            "quick": args.quick,
+        }
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        print("Warns")
+        results["warns"] = bench_warns(warn_sizes, workdir)
+    print("Transcripts")
+    results["transcript"] = bench_transcript(transcript_sizes)
+    print("Index des salons")
+    results["channels"] = bench_channels()
+    print("Checks de rôles")
+    results["roles"] = bench_roles()
+    print("Overwrites Muted")
+    results["mute"] = bench_mute()
+
+    try:
+        with open(args.output, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        print("Écarts >= 10 % avec le précédent résultat :")
+        compare(previous, results)
+    except (FileNotFoundError, ValueError):
+        pass
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Résultats écrits dans {args.output}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -4,13 +4,35 @@ from discord import app_commands
 from discord.ui import View, Button
 import os
 from dotenv import load_dotenv
-from flask import Flask
-from threading import Thread
 import json
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
+from discord.ext import tasks
 import html
-import textwrap
+import bisect
+import gzip
+import tempfile
+import shutil
+import zipfile
+import weakref
+import itertools
+import aiohttp
+from aiohttp import web
+import contextlib
+import io
+import contextvars
+import functools
+import time
+import hashlib
+import heapq
+import re
+from collections import OrderedDict, deque
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STARTED_AT = time.perf_counter()
 
 # ---------------------- CONFIG ----------------------
 load_dotenv()
@@ -28,41 +50,728 @@ WARN_ROLES = [
     "Modérateur/Modératrice", "Apprenti(e) Modérateur/Modératrice",
     "Administrateur/Administratrice"
 ]
-LOG_CHANNEL_NAME = "🟤・logs-warns"
-TICKET_LOG_CHANNEL = "🟤・logs-tickets"
-TRANSCRIPT_CHANNEL = "🟤・logs-tickets"
-WARNS_FILE = "warns.json"
+# Salons de logs : nom, ou ID via les variables d'environnement *_ID
+LOG_CHANNEL_NAME = int(os.getenv("LOG_CHANNEL_ID", 0)) or "🟤・logs-warns"
+TICKET_LOG_CHANNEL = int(os.getenv("TICKET_LOG_CHANNEL_ID", 0)) or "🟤・logs-tickets"
+TRANSCRIPT_CHANNEL = int(os.getenv("TRANSCRIPT_CHANNEL_ID", 0)) or "🟤・logs-tickets"
+# Sharding : nombre total de shards et shards gérés par ce processus
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0)) or None
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None
+SHARED_FILES = {}  # Fichier d'état du groupe de shards -> fichier commun
+
+
+def state_file(name):
+    # Avec SHARD_IDS, chaque processus a ses propres fichiers d'état :
+    # warns.json devient warns.shards-0-1.json
+    if not SHARD_IDS:
+        return name
+    base, ext = os.path.splitext(name)
+    path = f"{base}.shards-{'-'.join(map(str, SHARD_IDS))}{ext}"
+    SHARED_FILES[path] = name
+    return path
+
+
+def state_paths(*paths):
+    """Fichiers à lire au démarrage et s'il faut filtrer par serveur.
+
+    À la première exécution d'un groupe de shards, ses fichiers n'existent
+    pas encore : les fichiers communs sont lus et filtrés avec hosts_guild.
+    """
+    if not SHARD_IDS or any(os.path.exists(p) for p in paths):
+        return paths, False
+    return tuple(SHARED_FILES.get(p, p) for p in paths), True
+
+
+def hosts_guild(guild_id):
+    # Même répartition que Discord : (guild_id >> 22) % shard_count
+    if not (SHARD_IDS and SHARD_COUNT):
+        return True
+    return (int(guild_id) >> 22) % SHARD_COUNT in SHARD_IDS
+
+
+TICKETS_FILE = state_file("tickets.json")
+SANCTIONS_FILE = state_file("sanctions.json")  # Sanctions temporaires en attente
+SANCTIONS_JOURNAL = state_file("sanctions.journal")  # Journal append-only des sanctions
+SANCTIONS_COMPACT_EVERY = 200  # Entrées de journal avant compaction
+SANCTION_RETRY_SECONDS = 300  # Serveur indisponible : nouvel essai plus tard
+ROLE_INDEX_FILE = state_file("role_index.json")  # IDs des rôles résolus depuis leur nom
+CACHE_PROFILE = os.getenv("BOT_CACHE_PROFILE", "full")  # full, standard, minimal
+GUILD_CONFIG_FILE = "guild_config.json"  # Réglages par serveur (voir CONFIG PAR SERVEUR)
+GUILD_CONFIG_RELOAD_SECONDS = 30  # Rechargement si le fichier a changé
+COMMAND_SYNC_FILE = ".command_sync.json"  # Empreinte des commandes synchronisées
+# Serveurs de synchronisation immédiate (séparés par des virgules). Si défini,
+# les commandes sont synchronisées sur ces serveurs au lieu de globalement.
+SYNC_GUILD_IDS = [int(g) for g in os.getenv("SYNC_GUILD_IDS", "").split(",") if g.strip()]
+WARNS_FILE = state_file("warns.json")
+# Serveur principal : reçoit les warns enregistrés avant le découpage par serveur
+HOME_GUILD_ID = int(os.getenv("HOME_GUILD_ID", 0))
+WARNS_JOURNAL = state_file("warns.journal")  # Journal append-only des warns
+WARNS_COMPACT_EVERY = 500  # Nombre d'entrées de journal avant compaction
+WARNS_COMPACT_MINUTES = 10  # Compaction périodique
+CLEAR_MAX = 10000  # Messages supprimés au maximum par /clear
+CLEAR_SCAN_LIMIT = 50000  # Messages parcourus au maximum par /clear
+CLEAR_OLD_DELETE_DELAY = 1.0  # Pause entre suppressions unitaires (> 14 jours)
+CLEAR_OLD_MAX = 100  # Suppressions unitaires (> 14 jours) au maximum par /clear
+CLEAR_PROGRESS_MINUTES = 14  # Le jeton d'interaction expire après 15 minutes
+ACTION_WORKERS = 4  # Tâches qui exécutent les effets de bord
+ACTION_RETRIES = 3  # Nouvelles tentatives sur erreur serveur/réseau
+ACTION_ROUTE_LIMITS = {"roles": 4, "messages": 4, "log": 2, "dm": 2}  # Concurrence par route
+LOG_SINK_WINDOW = 2.0  # Secondes d'attente avant l'envoi d'un lot de logs
+LOG_SINK_MAX_PENDING = 50  # Embeds en attente par salon avant de bloquer
+EMBED_MAX_CHARS = 6000  # Limite Discord par message, tous embeds confondus
+MUTED_ROLE_NAME = "Muted"
+AUTOMOD_ENABLED = os.getenv("AUTOMOD", "0") == "1"  # Désactivé par défaut
+AUTOMOD_BANNED_WORDS = [
+    w.strip() for w in os.getenv("AUTOMOD_BANNED_WORDS", "").split(",")
+    if w.strip()
+]
+AUTOMOD_RATE_COUNT = 6  # Messages max...
+AUTOMOD_RATE_WINDOW = 5.0  # ...sur cette fenêtre (secondes) avant mute
+AUTOMOD_DUPLICATE_COUNT = 3  # Messages identiques avant warn...
+AUTOMOD_DUPLICATE_WINDOW = 30.0  # ...sur cette fenêtre (secondes)
+AUTOMOD_DUPLICATE_HISTORY = 5  # Empreintes gardées par utilisateur
+AUTOMOD_DUPLICATE_MIN_LENGTH = 10  # Messages plus courts ignorés ("ok", "oui")
+AUTOMOD_MAX_USERS = 10000  # Utilisateurs suivis au maximum
+AUTOMOD_IDLE_SECONDS = 600  # Un utilisateur inactif est oublié
+AUTOMOD_MUTE_DURATION = timedelta(minutes=10)  # Mute automatique pour flood
+WARN_EXPIRY_DAYS = int(os.getenv("WARN_EXPIRY_DAYS", 0))  # 0 : jamais
+# Sanctions automatiques, désactivées par défaut. À activer par serveur
+# via "warn_thresholds" dans GUILD_CONFIG_FILE, par exemple :
+#   [{"warns": 3, "window": "1j", "sanction": "mute", "duration": "1h"},
+#    {"warns": 5, "window": "7j", "sanction": "ban", "duration": "1j"}]
+# Sans "duration", la sanction est permanente.
+WARN_THRESHOLDS = []
+MUTE_SYNC_CONCURRENCY = 5  # Requêtes set_permissions simultanées
+
+# ---------------------- MÉTRIQUES ----------------------
+# Latences des commandes et boutons, appels REST par handler, latence
+# gateway, retard de la boucle et durée des transcripts, exposés au
+# format Prometheus sur /metrics.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TRANSCRIPT_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LOOP_LAG_INTERVAL = 1.0
+current_handler = contextvars.ContextVar("current_handler", default="none")
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf", ), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+def prom_number(value):
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(value)
+
+
+class Metrics:
+
+    def __init__(self):
+        self.latency = {}  # (type, nom) -> Histogram
+        self.errors = {}  # (type, nom) -> nombre
+        self.rest_calls = {}  # (handler, méthode, route) -> nombre
+        self.transcript = Histogram(TRANSCRIPT_BUCKETS)
+        self.loop_lag = 0.0
+
+    def observe(self, kind, name, seconds):
+        histogram = self.latency.get((kind, name))
+        if histogram is None:
+            histogram = self.latency[(kind, name)] = Histogram()
+        histogram.observe(seconds)
+
+    def error(self, kind, name):
+        self.errors[(kind, name)] = self.errors.get((kind, name), 0) + 1
+
+    def rest_call(self, method, path):
+        key = (current_handler.get(), method, path)
+        self.rest_calls[key] = self.rest_calls.get(key, 0) + 1
+
+    @contextlib.contextmanager
+    def handler(self, kind, name):
+        token = current_handler.set(f"{kind}:{name}")
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(kind, name)
+            raise
+        finally:
+            self.observe(kind, name, time.perf_counter() - start)
+            current_handler.reset(token)
+
+    def render(self):
+        lines = [
+            "# TYPE bot_handler_latency_seconds histogram",
+        ]
+        for (kind, name), histogram in list(self.latency.items()):
+            lines += histogram.render(
+                "bot_handler_latency_seconds",
+                f'type="{kind}",name="{prom_label(name)}"')
+        lines.append("# TYPE bot_handler_errors_total counter")
+        for (kind, name), count in list(self.errors.items()):
+            lines.append(
+                f'bot_handler_errors_total{{type="{kind}",name="{prom_label(name)}"}} {count}'
+            )
+        lines.append("# TYPE bot_rest_calls_total counter")
+        for (handler, method, path), count in list(self.rest_calls.items()):
+            lines.append(
+                f'bot_rest_calls_total{{handler="{prom_label(handler)}",method="{method}",route="{prom_label(path)}"}} {count}'
+            )
+        lines.append("# TYPE bot_transcript_seconds histogram")
+        lines += self.transcript.render("bot_transcript_seconds")
+        lines += [
+            "# TYPE bot_gateway_latency_seconds gauge",
+            f"bot_gateway_latency_seconds {prom_number(bot.latency)}",
+            "# TYPE bot_event_loop_lag_seconds gauge",
+            f"bot_event_loop_lag_seconds {self.loop_lag}",
+            "# TYPE bot_action_queue_depth gauge",
+            f"bot_action_queue_depth {action_queue.depth()}",
+            "# TYPE bot_log_sink_pending gauge",
+            f"bot_log_sink_pending {log_sink.pending()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def instrumented(kind, name):
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with metrics.handler(kind, name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics.loop_lag = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+
+
+class CommandTree(app_commands.CommandTree):
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Même tâche que la commande : les appels REST lui sont attribués
+        if interaction.command:
+            kind = ("autocomplete" if interaction.type
+                    is discord.InteractionType.autocomplete else "command")
+            current_handler.set(
+                f"{kind}:{interaction.command.qualified_name}")
+            interaction.extras["started"] = time.perf_counter()
+        return True
+
 
 # ---------------------- BOT ----------------------
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents)
+class Bot(commands.AutoShardedBot):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http_runner = None
+
+    async def setup_hook(self):
+        # Exécuté une seule fois, avant la connexion à la gateway
+        self.add_view(TicketView())
+        self.add_view(CloseTicketView())
+        action_queue.start()
+        compact_warns.start()
+        watch_guild_config.start()
+        asyncio.create_task(monitor_loop_lag())
+        self.http_runner = await keep_alive()
+        if TRANSCRIPT_ARCHIVE:
+            await archiver.start()
+            prune_transcript_assets.start()
+        try:
+            await sync_commands()
+        except Exception as e:
+            print(f"Erreur de sync: {e}")
+
+    async def close(self):
+        # Vider les logs en attente tant que la connexion est encore ouverte
+        log_sink.flush_all()
+        await action_queue.drain()
+        await warn_store.compact()
+        await sanction_scheduler.compact()
+        await role_index.save()
+        await super().close()
+        await archiver.close()
+        if self.http_runner:
+            await self.http_runner.cleanup()
+
+
+# Profils de cache : intents, cache des membres, chunking et cache de messages.
+# Les commandes slash reçoivent membres et rôles dans le payload de
+# l'interaction, elles fonctionnent donc avec tous les profils.
+def standard_intents():
+    intents = discord.Intents.all()
+    intents.presences = False
+    return intents
+
+
+def minimal_intents():
+    intents = discord.Intents.default()
+    intents.message_content = True  # Transcripts des tickets
+    return intents
+
+
+CACHE_PROFILES = {
+    # Comportement historique : tous les membres et présences en mémoire.
+    "full": {
+        "intents": discord.Intents.all,
+        "member_cache_flags": None,
+        "chunk_guilds_at_startup": True,
+        "max_messages": 1000,
+        "description": "Tout en cache, démarrage le plus lent.",
+    },
+    # Sans présences, membres chargés à la demande.
+    "standard": {
+        "intents": standard_intents,
+        "member_cache_flags": None,
+        "chunk_guilds_at_startup": False,
+        "max_messages": 1000,
+        "description":
+        "Sans présences, pas de chunking au démarrage. Aucune commande impactée.",
+    },
+    # Ni intent members ni présences, aucun membre en cache.
+    "minimal": {
+        "intents": minimal_intents,
+        "member_cache_flags": discord.MemberCacheFlags.none,
+        "chunk_guilds_at_startup": False,
+        "max_messages": 100,
+        "description":
+        "Aucun membre en cache. Le registre des tickets ne peut plus deviner "
+        "le propriétaire d'un ancien ticket par son pseudo après un "
+        "redémarrage sans tickets.json.",
+    },
+}
+
+
+def bot_options(profile):
+    options = CACHE_PROFILES[profile]
+    kwargs = {
+        "intents": options["intents"](),
+        "chunk_guilds_at_startup": options["chunk_guilds_at_startup"],
+        "max_messages": options["max_messages"],
+    }
+    if options["member_cache_flags"]:
+        kwargs["member_cache_flags"] = options["member_cache_flags"]()
+    return kwargs
+
+
+def startup_report():
+    rss = (f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} Mo"
+           if resource else "inconnue")
+    members = sum(len(g.members) for g in bot.guilds)
+    print(f"Profil de cache « {CACHE_PROFILE} » : "
+          f"{CACHE_PROFILES[CACHE_PROFILE]['description']}\n"
+          f"  Prêt en {time.perf_counter() - STARTED_AT:.1f} s, "
+          f"mémoire max {rss}, {len(bot.guilds)} serveur(s), "
+          f"{members} membre(s) en cache.")
+
+
+bot = Bot(command_prefix="!",
+          tree_cls=CommandTree,
+          shard_count=SHARD_COUNT,
+          shard_ids=SHARD_IDS,
+          **bot_options(CACHE_PROFILE))
 tree = bot.tree
+http_request = bot.http.request
+
+
+async def counted_request(route, **kwargs):
+    metrics.rest_call(route.method, route.path)
+    return await http_request(route, **kwargs)
+
+
+bot.http.request = counted_request
 
-# ---------------------- SERVEUR FLASK ----------------------
-app = Flask('')
+# ---------------------- SERVEUR HTTP ----------------------
+# Serveur aiohttp sur la boucle du bot : /healthz reflète l'état réel de la
+# connexion gateway, /readyz n'est OK qu'une fois le bot prêt.
+HTTP_PORT = int(os.getenv("PORT", 8080))
+HEALTH_GRACE = 60  # Secondes de déconnexion gateway tolérées par /healthz
+gateway_state = {}  # shard_id -> (connecté, depuis)
 
 
-@app.route('/')
-def home():
-    return "Bot Discord en ligne !"
-
+def gateway_connected():
+    return bool(gateway_state) and all(c for c, _ in gateway_state.values())
+
+
+def gateway_down_for():
+    now = time.monotonic()
+    if not gateway_state:
+        return now - gateway_started
+    return max((now - since for c, since in gateway_state.values() if not c),
+               default=0.0)
+
+
+gateway_started = time.monotonic()
+
+
+async def home(request):
+    return web.Response(text="Bot Discord en ligne !")
+
+
+async def healthz(request):
+    connected = gateway_connected()
+    alive = not bot.is_closed() and (connected
+                                     or gateway_down_for() < HEALTH_GRACE)
+    return web.json_response(
+        {
+            "gateway": connected,
+            "shards": {
+                str(shard_id): c
+                for shard_id, (c, _) in gateway_state.items()
+            },
+            "latency": bot.latency if connected else None
+        },
+        status=200 if alive else 503)
+
+
+async def readyz(request):
+    ready = bot.is_ready() and gateway_connected()
+    return web.json_response({"ready": ready}, status=200 if ready else 503)
+
+
+async def metrics_endpoint(request):
+    # Format d'exposition texte de Prometheus
+    return web.Response(
+        body=metrics.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def keep_alive():
+    if not (os.getenv("REPLIT") or os.getenv("RAILWAY")):
+        return None
+    app = web.Application()
+    app.add_routes([
+        web.get("/", home),
+        web.get("/healthz", healthz),
+        web.get("/readyz", readyz),
+        web.get("/metrics", metrics_endpoint),
+    ])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", HTTP_PORT).start()
+    return runner
+
+
+# ---------------------- CONFIG PAR SERVEUR ----------------------
+# Les constantes de CONFIG servent de valeurs par défaut. GUILD_CONFIG_FILE
+# peut les surcharger globalement ("default") ou par serveur ("guilds") :
+#   {"default": {...}, "guilds": {"<guild_id>": {"log_channel": 123, ...}}}
+# Le fichier est rechargé à chaud (/reloadconfig ou modification détectée).
+DEFAULT_GUILD_CONFIG = {
+    "authorized_roles": AUTHORIZED_ROLES,
+    "warn_roles": WARN_ROLES,
+    "ticket_role": TICKET_ROLE,
+    # Rôles par ID, insensibles aux renommages
+    "authorized_role_ids": [],
+    "warn_role_ids": [],
+    "ticket_role_ids": [],
+    "ticket_category_id": TICKET_CATEGORY_ID,
+    "recruiter_role_id": RECRUITER_ROLE_ID,
+    "log_channel": LOG_CHANNEL_NAME,
+    "ticket_log_channel": TICKET_LOG_CHANNEL,
+    "transcript_channel": TRANSCRIPT_CHANNEL,
+    "automod_banned_words": AUTOMOD_BANNED_WORDS,
+    "warn_thresholds": WARN_THRESHOLDS,
+}
+
+
+def is_list_of(kind):
+    return lambda value: isinstance(value, list) and all(
+        isinstance(v, kind) for v in value)
+
+
+def is_warn_thresholds(value):
+    # parse_warn_thresholds lève une erreur sur un seuil invalide
+    return isinstance(value, list) and parse_warn_thresholds(value) is not None
+
+
+GUILD_CONFIG_TYPES = {
+    "authorized_roles": is_list_of(str),
+    "warn_roles": is_list_of(str),
+    "ticket_role": lambda value: isinstance(value, str),
+    "authorized_role_ids": is_list_of(int),
+    "warn_role_ids": is_list_of(int),
+    "ticket_role_ids": is_list_of(int),
+    "ticket_category_id": lambda value: isinstance(value, int),
+    "recruiter_role_id": lambda value: isinstance(value, int),
+    "log_channel": lambda value: isinstance(value, (str, int)),
+    "ticket_log_channel": lambda value: isinstance(value, (str, int)),
+    "transcript_channel": lambda value: isinstance(value, (str, int)),
+    "automod_banned_words": is_list_of(str),
+    "warn_thresholds": is_warn_thresholds,
+}
+
+
+def validate_guild_config(data):
+    """Lève ValueError si le fichier n'a pas la forme attendue."""
+    if not isinstance(data, dict):
+        raise ValueError("la racine doit être un objet")
+    sections = [("default", data.get("default", {}))]
+    guilds = data.get("guilds", {})
+    if not isinstance(guilds, dict):
+        raise ValueError("\"guilds\" doit être un objet")
+    for guild_id, values in guilds.items():
+        if not guild_id.isdigit():
+            raise ValueError(f"ID de serveur invalide : {guild_id!r}")
+        sections.append((guild_id, values))
+    for name, values in sections:
+        if not isinstance(values, dict):
+            raise ValueError(f"\"{name}\" doit être un objet")
+        for key, value in values.items():
+            check = GUILD_CONFIG_TYPES.get(key)
+            if check is None:
+                raise ValueError(f"{name}: clé inconnue {key!r}")
+            try:
+                valid = check(value)
+            except (KeyError, TypeError, ValueError):
+                valid = False
+            if not valid:
+                raise ValueError(f"{name}: valeur invalide pour {key!r}")
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
 
+class GuildConfigStore:
 
-def keep_alive():
-    if os.getenv("REPLIT") or os.getenv("RAILWAY"):
-        t = Thread(target=run)
-        t.start()
+    def __init__(self):
+        self.defaults = dict(DEFAULT_GUILD_CONFIG)
+        self.overrides = {}
+        self.cache = {}
+        self.mtime = None
+        self.error = None  # Dernière erreur de chargement
+        self.failed_mtime = None
+
+    def read(self):
+        try:
+            mtime = os.path.getmtime(GUILD_CONFIG_FILE)
+        except OSError:
+            return None, "{}"
+        with open(GUILD_CONFIG_FILE, "r", encoding="utf-8") as f:
+            return mtime, f.read()
+
+    def parse(self, text):
+        data = json.loads(text)
+        validate_guild_config(data)
+        return data
+
+    def apply(self, mtime, data):
+        self.defaults = {**DEFAULT_GUILD_CONFIG, **data.get("default", {})}
+        self.overrides = {
+            int(guild_id): values
+            for guild_id, values in data.get("guilds", {}).items()
+        }
+        self.cache.clear()
+        self.mtime = mtime
+        # Les index dérivés des noms de rôles et de salons sont reconstruits
+        role_index.guilds.clear()
+        channel_index.guilds.clear()
+        automod.matchers.clear()
+
+    def load(self):
+        # Au démarrage, une config invalide empêche le lancement
+        mtime, text = self.read()
+        self.apply(mtime, self.parse(text))
+
+    async def reload(self, force=False):
+        # En cas d'erreur, la configuration actuelle est conservée
+        mtime, text = await asyncio.to_thread(self.read)
+        if not force and mtime in (self.mtime, self.failed_mtime):
+            return False
+        try:
+            data = self.parse(text)
+        except ValueError as e:
+            # Signalée une seule fois par version du fichier
+            self.error = str(e)
+            self.failed_mtime = mtime
+            print(f"Erreur dans {GUILD_CONFIG_FILE}: {e}")
+            return False
+        self.apply(mtime, data)
+        self.error = self.failed_mtime = None
+        return True
+
+    def get(self, guild):
+        guild_id = getattr(guild, "id", guild)
+        config = self.cache.get(guild_id)
+        if config is None:
+            config = self.cache[guild_id] = {
+                **self.defaults,
+                **self.overrides.get(guild_id, {})
+            }
+        return config
+
+
+guild_config = GuildConfigStore()
+
+
+@tasks.loop(seconds=GUILD_CONFIG_RELOAD_SECONDS)
+async def watch_guild_config():
+    try:
+        if await guild_config.reload():
+            print("Configuration des serveurs rechargée.")
+        await role_index.save()
+    except Exception as e:
+        print(f"Erreur rechargement configuration: {e}")
 
 
 # ---------------------- CHECKS ----------------------
+# Les rôles autorisés sont résolus une fois par serveur en frozensets d'IDs,
+# tenus à jour par les events de rôles. Chaque rôle résolu par son nom est
+# retenu dans ROLE_INDEX_FILE avec ce nom : un rôle renommé garde ses
+# permissions, même après un rechargement de la config ou un redémarrage.
+def role_groups(guild):
+    """groupe -> (noms, IDs) des rôles autorisés."""
+    config = guild_config.get(guild)
+    return {
+        "authorized": (config["authorized_roles"],
+                       config["authorized_role_ids"]),
+        "warn": (config["warn_roles"], config["warn_role_ids"]),
+        "ticket": (config["authorized_roles"] + [config["ticket_role"]],
+                   config["authorized_role_ids"] +
+                   config["ticket_role_ids"]),
+    }
+
+
+class RoleIndex:
+
+    def __init__(self):
+        self.guilds = {}  # guild_id -> {groupe: frozenset(role_id)}
+        self.resolved = {}  # guild_id -> {role_id: nom lors de la résolution}
+        self.dirty = False
+        self.save_lock = asyncio.Lock()
+
+    def load(self):
+        (path, ), seeded = state_paths(ROLE_INDEX_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        self.resolved = {
+            int(guild_id): {int(rid): name for rid, name in roles.items()}
+            for guild_id, roles in data.items()
+            if not seeded or hosts_guild(guild_id)
+        }
+        self.dirty = seeded
+
+    def resolve(self, role):
+        """Retient l'ID d'un rôle portant un nom autorisé."""
+        resolved = self.resolved.setdefault(role.guild.id, {})
+        if role.id in resolved:
+            return
+        if any(role.name in names
+               for names, _ in role_groups(role.guild).values()):
+            resolved[role.id] = role.name
+            self.dirty = True
+
+    def build(self, guild):
+        resolved = self.resolved.setdefault(guild.id, {})
+        for role in guild.roles:
+            self.resolve(role)
+        for role_id in [rid for rid in resolved if guild.get_role(rid) is None]:
+            del resolved[role_id]
+            self.dirty = True
+        index = {}
+        for group, (names, ids) in role_groups(guild).items():
+            names = set(names)
+            index[group] = frozenset(
+                [rid for rid, name in resolved.items() if name in names] +
+                [rid for rid in ids if guild.get_role(rid) is not None])
+        self.guilds[guild.id] = index
+        return index
+
+    def get(self, guild, group):
+        index = self.guilds.get(guild.id) or self.build(guild)
+        return index[group]
+
+    def add_role(self, role):
+        self.resolve(role)
+        if role.guild.id in self.guilds:
+            self.build(role.guild)
+
+    def remove_role(self, role):
+        if self.resolved.get(role.guild.id, {}).pop(role.id, None):
+            self.dirty = True
+        index = self.guilds.get(role.guild.id)
+        if index is None:
+            return
+        for group, ids in index.items():
+            if role.id in ids:
+                index[group] = ids - {role.id}
+
+    async def save(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        data = json.dumps({
+            str(guild_id): {str(rid): name for rid, name in roles.items()}
+            for guild_id, roles in self.resolved.items() if roles
+        }, indent=2)
+        async with self.save_lock:
+            await asyncio.to_thread(self._write, data)
+
+    def _write(self, data):
+        tmp = ROLE_INDEX_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, ROLE_INDEX_FILE)
+
+
+role_index = RoleIndex()
+
+
+def member_has_group(guild, member, group) -> bool:
+    return any(
+        member.get_role(role_id) is not None
+        for role_id in role_index.get(guild, group))
+
+
+def member_in_group(interaction: discord.Interaction, group) -> bool:
+    if interaction.guild is None:
+        return False
+    return member_has_group(interaction.guild, interaction.user, group)
+
+
 def is_authorized():
 
     def predicate(interaction: discord.Interaction) -> bool:
-        user_roles = [role.name for role in interaction.user.roles]
-        return any(role in AUTHORIZED_ROLES for role in user_roles)
+        return member_in_group(interaction, "authorized")
 
     return app_commands.check(predicate)
 
@@ -70,8 +779,7 @@ def is_authorized():
 def has_warn_role():
 
     def predicate(interaction: discord.Interaction) -> bool:
-        user_roles = [role.name for role in interaction.user.roles]
-        return any(role in WARN_ROLES for role in user_roles)
+        return member_in_group(interaction, "warn")
 
     return app_commands.check(predicate)
 
@@ -79,110 +787,1904 @@ def has_warn_role():
 def has_ticket_permission():
 
     def predicate(interaction: discord.Interaction) -> bool:
-        user_roles = [role.name for role in interaction.user.roles]
-        return any(role in (AUTHORIZED_ROLES + [TICKET_ROLE])
-                   for role in user_roles)
+        return member_in_group(interaction, "ticket")
 
     return app_commands.check(predicate)
 
 
 # ---------------------- UTILITAIRES ----------------------
+def normalize_channel_name(name):
+    return name.lower().replace("・", "").replace(" ", "-")
+
+
+# Index par serveur : nom normalisé -> IDs des salons textuels portant ce
+# nom (le premier gagne), construit à la première recherche puis tenu à
+# jour entrée par entrée par les events de salons.
+class ChannelIndex:
+
+    def __init__(self):
+        self.guilds = {}
+
+    def build(self, guild):
+        index = {}
+        for c in guild.text_channels:
+            index.setdefault(normalize_channel_name(c.name), []).append(c.id)
+        self.guilds[guild.id] = index
+        return index
+
+    def get(self, guild, name):
+        index = self.guilds.get(guild.id) or self.build(guild)
+        channel_ids = index.get(normalize_channel_name(name))
+        return guild.get_channel(channel_ids[0]) if channel_ids else None
+
+    def add_channel(self, channel, name=None):
+        index = self.guilds.get(channel.guild.id)
+        if index is not None and isinstance(channel, discord.TextChannel):
+            key = normalize_channel_name(name or channel.name)
+            channel_ids = index.setdefault(key, [])
+            if channel.id not in channel_ids:
+                channel_ids.append(channel.id)
+
+    def remove_channel(self, channel, name=None):
+        index = self.guilds.get(channel.guild.id)
+        if index is None:
+            return
+        key = normalize_channel_name(name or channel.name)
+        channel_ids = index.get(key)
+        if channel_ids and channel.id in channel_ids:
+            channel_ids.remove(channel.id)
+            if not channel_ids:
+                del index[key]
+
+    def rename_channel(self, before, after):
+        self.remove_channel(after, before.name)
+        self.add_channel(after)
+
+
+channel_index = ChannelIndex()
+
+
 def get_channel_by_name(guild, name):
-    cleaned = name.lower().replace("・", "").replace(" ", "-")
-    return next(
-        (c for c in guild.text_channels
-         if c.name.lower().replace("・", "").replace(" ", "-") == cleaned),
-        None)
+    if isinstance(name, int):
+        return guild.get_channel(name)
+    return channel_index.get(guild, name)
 
 
-def load_warns():
+def load_warns(path=None):
     try:
-        with open(WARNS_FILE, "r", encoding="utf-8") as f:
+        with open(path or WARNS_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
     except FileNotFoundError:
         return {}
 
 
 def save_warns(data):
-    with open(WARNS_FILE, "w", encoding="utf-8") as f:
+    tmp = WARNS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, WARNS_FILE)
 
 
-async def generate_transcript(channel: discord.TextChannel) -> discord.File:
-    messages = []
-    async for message in channel.history(limit=None, oldest_first=True):
-        timestamp = message.created_at.strftime("%d/%m/%Y %H:%M:%S")
-        author = html.escape(message.author.display_name)
-        content = html.escape(message.content) if message.content else ""
-        attachments = ""
-        for a in message.attachments:
-            if a.content_type and a.content_type.startswith("image"):
-                attachments += f'<br><img src="{a.url}" width="200">'
-            else:
-                attachments += f'<br><a href="{a.url}">[Fichier]</a>'
-        msg_html = (
-            '<div class="message">'
-            f'<img src="{message.author.avatar.url if message.author.avatar else message.author.default_avatar.url}" class="avatar">'
+# ---------------------- STOCKAGE DES WARNS ----------------------
+# Index en mémoire (guild_id -> user_id -> warns) chargé une seule fois au
+# démarrage. Chaque warn est ajouté à un journal append-only ; warns.json
+# n'est réécrit qu'à la compaction. Les écritures disque se font hors de la
+# boucle. Les warns d'avant le découpage par serveur (user_id -> warns)
+# sont rattachés à HOME_GUILD_ID ou, s'il n'est pas défini, au seul serveur
+# du bot dans on_ready.
+class WarnIndex:
+    """Index secondaires des warns d'un serveur."""
+
+    def __init__(self):
+        # (timestamp, user_id, warn) triés par date, (user_id, warn) par
+        # modérateur dans l'ordre chronologique (avec leurs timestamps pour
+        # la bisection), et nombre de warns -> membres pour le classement
+        self.by_time = []
+        self.time_keys = []
+        self.by_moderator = {}
+        self.moderator_keys = {}
+        self.counts = {}
+        self.by_count = {}
+        self.max_count = 0
+
+    def build(self, warns):
+        self.by_time = sorted(((w["timestamp"], uid, w)
+                               for uid, ws in warns.items() for w in ws),
+                              key=lambda item: item[0])
+        self.time_keys = [item[0] for item in self.by_time]
+        self.by_moderator = {}
+        self.moderator_keys = {}
+        for ts, uid, w in self.by_time:
+            self.by_moderator.setdefault(w["moderator"], []).append((uid, w))
+            self.moderator_keys.setdefault(w["moderator"], []).append(ts)
+        self.counts = {uid: len(ws) for uid, ws in warns.items() if ws}
+        self.by_count = {}
+        for uid, count in self.counts.items():
+            self.by_count.setdefault(count, set()).add(uid)
+        self.max_count = max(self.by_count, default=0)
+        return self
+
+    def _count_move(self, user_id, delta):
+        count = self.counts.get(user_id, 0)
+        if count:
+            users = self.by_count[count]
+            users.discard(user_id)
+            if not users:
+                del self.by_count[count]
+        count += delta
+        if count:
+            self.counts[user_id] = count
+            self.by_count.setdefault(count, set()).add(user_id)
+        else:
+            self.counts.pop(user_id, None)
+        if count > self.max_count:
+            self.max_count = count
+        while self.max_count and self.max_count not in self.by_count:
+            self.max_count -= 1
+
+    def add(self, user_id, warn):
+        ts = warn["timestamp"]
+        i = bisect.bisect_right(self.time_keys, ts)
+        self.time_keys.insert(i, ts)
+        self.by_time.insert(i, (ts, user_id, warn))
+        keys = self.moderator_keys.setdefault(warn["moderator"], [])
+        i = bisect.bisect_right(keys, ts)
+        keys.insert(i, ts)
+        self.by_moderator.setdefault(warn["moderator"], []).insert(
+            i, (user_id, warn))
+        self._count_move(user_id, 1)
+
+    def remove(self, user_id, warn):
+        ts = warn["timestamp"]
+        i = bisect.bisect_left(self.time_keys, ts)
+        while i < len(self.by_time) and self.time_keys[i] == ts:
+            if self.by_time[i][1] == user_id:
+                del self.by_time[i]
+                del self.time_keys[i]
+                break
+            i += 1
+        keys = self.moderator_keys.get(warn["moderator"], [])
+        entries = self.by_moderator.get(warn["moderator"], [])
+        i = bisect.bisect_left(keys, ts)
+        while i < len(keys) and keys[i] == ts:
+            if entries[i][0] == user_id:
+                del entries[i]
+                del keys[i]
+                break
+            i += 1
+        self._count_move(user_id, -1)
+
+    def time_range(self, start, end):
+        # Bornes [lo, hi) de by_time pour start <= timestamp < end
+        return (bisect.bisect_left(self.time_keys, start.isoformat()),
+                bisect.bisect_left(self.time_keys, end.isoformat()))
+
+    def top_offenders(self, limit):
+        # Parcourt l'index par nombre de warns, du plus grand au plus petit
+        top = []
+        for count in range(self.max_count, 0, -1):
+            users = self.by_count.get(count, ())
+            top += [(count, uid)
+                    for uid in heapq.nlargest(limit - len(top), users)]
+            if len(top) == limit:
+                break
+        return top
+
+
+class WarnStore:
+
+    def __init__(self):
+        self.warns = {}
+        self.indexes = {}  # guild_id -> WarnIndex
+        self.pending = 0
+        self.lock = asyncio.Lock()
+
+    def load(self):
+        home = str(HOME_GUILD_ID)
+        (snapshot, journal), seeded = state_paths(WARNS_FILE, WARNS_JOURNAL)
+        self.warns = {}
+        for key, value in load_warns(snapshot).items():
+            # Ancien format : user_id -> warns, sans serveur
+            guild_id, users = (home, {key: value}) if isinstance(
+                value, list) else (key, value)
+            guild_warns = self.warns.setdefault(guild_id, {})
+            for uid, ws in users.items():
+                guild_warns.setdefault(uid, []).extend(ws)
+        if HOME_GUILD_ID and "0" in self.warns:
+            # Warns importés avant que HOME_GUILD_ID soit défini
+            for uid, ws in self.warns.pop("0").items():
+                self.warns.setdefault(home, {}).setdefault(uid, []).extend(ws)
+        self.pending = 0
+        try:
+            with open(journal, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Dernière ligne tronquée par un arrêt brutal
+                        continue
+                    self._replay(record)
+                    self.pending += 1
+        except FileNotFoundError:
+            pass
+        if seeded:
+            # Première exécution du groupe de shards : ses propres fichiers
+            self.warns = {guild_id: users
+                          for guild_id, users in self.warns.items()
+                          if hosts_guild(guild_id)}
+            self._write_snapshot(self._snapshot())
+            self.pending = 0
+        self.indexes = {
+            guild_id: WarnIndex().build(users)
+            for guild_id, users in self.warns.items()
+        }
+
+    def _replay(self, record):
+        guild_id = str(record.get("guild_id", HOME_GUILD_ID))
+        user_warns = self.warns.setdefault(guild_id, {}).setdefault(
+            record["user_id"], [])
+        if record.get("op", "add") == "add":
+            # Une compaction interrompue peut rejouer un warn déjà présent
+            if record["warn"] not in user_warns:
+                user_warns.append(record["warn"])
+        elif record["op"] == "remove":
+            user_warns[:] = [
+                w for w in user_warns if w["timestamp"] != record["timestamp"]
+            ]
+
+    def legacy_count(self):
+        return sum(len(ws) for ws in self.warns.get("0", {}).values())
+
+    async def adopt_legacy(self, guild_id):
+        """Rattache les warns sans serveur (guild "0") à guild_id."""
+        legacy = self.warns.pop("0", None)
+        self.indexes.pop("0", None)
+        if not legacy:
+            return
+        guild_warns = self.warns.setdefault(str(guild_id), {})
+        for uid, ws in legacy.items():
+            user_warns = guild_warns.setdefault(uid, [])
+            user_warns += [w for w in ws if w not in user_warns]
+            user_warns.sort(key=lambda w: w["timestamp"])
+        self.indexes[str(guild_id)] = WarnIndex().build(guild_warns)
+        async with self.lock:
+            await self._compact()
+
+    def index(self, guild_id):
+        guild_id = str(guild_id)
+        index = self.indexes.get(guild_id)
+        if index is None:
+            index = self.indexes[guild_id] = WarnIndex()
+        return index
+
+    def get(self, guild_id, user_id):
+        return self.warns.get(str(guild_id), {}).get(str(user_id), [])
+
+    def recent_count(self, guild_id, user_id, window):
+        # Les warns sont dans l'ordre chronologique : on remonte depuis la fin
+        cutoff = (datetime.utcnow() - window).isoformat()
+        count = 0
+        for warn in reversed(self.get(guild_id, user_id)):
+            if warn["timestamp"] < cutoff:
+                break
+            if not warn.get("automod"):
+                count += 1
+        return count
+
+    async def add(self, guild_id, user_id, entry):
+        guild_id, user_id = str(guild_id), str(user_id)
+        self.warns.setdefault(guild_id, {}).setdefault(user_id,
+                                                       []).append(entry)
+        self.index(guild_id).add(user_id, entry)
+        await self._journal({
+            "op": "add",
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "warn": entry
+        })
+
+    async def remove(self, guild_id, user_id, timestamp):
+        guild_id, user_id = str(guild_id), str(user_id)
+        user_warns = self.get(guild_id, user_id)
+        removed = [w for w in user_warns if w["timestamp"] == timestamp]
+        if not removed:
+            return False
+        user_warns[:] = [w for w in user_warns if w["timestamp"] != timestamp]
+        index = self.index(guild_id)
+        for warn in removed:
+            index.remove(user_id, warn)
+        await self._journal({
+            "op": "remove",
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "timestamp": timestamp
+        })
+        return True
+
+    async def _journal(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        async with self.lock:
+            await asyncio.to_thread(self._append, line)
+            self.pending += 1
+            if self.pending >= WARNS_COMPACT_EVERY:
+                await self._compact()
+
+    def _append(self, line):
+        with open(WARNS_JOURNAL, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def compact(self):
+        async with self.lock:
+            if self.pending:
+                await self._compact()
+
+    def _snapshot(self):
+        snapshot = {}
+        for guild_id, users in self.warns.items():
+            guild_warns = {uid: list(ws) for uid, ws in users.items() if ws}
+            if guild_warns:
+                snapshot[guild_id] = guild_warns
+        return snapshot
+
+    async def _compact(self):
+        await asyncio.to_thread(self._write_snapshot, self._snapshot())
+        self.pending = 0
+
+    def _write_snapshot(self, snapshot):
+        save_warns(snapshot)
+        open(WARNS_JOURNAL, "w", encoding="utf-8").close()
+
+
+warn_store = WarnStore()
+
+
+@tasks.loop(minutes=WARNS_COMPACT_MINUTES)
+async def compact_warns():
+    try:
+        await warn_store.compact()
+    except Exception as e:
+        print(f"Erreur compaction warns: {e}")
+
+
+TRANSCRIPT_CHUNK = 200  # Messages rendus par lot hors de la boucle
+TRANSCRIPT_SPOOL_SIZE = 8 * 1024 * 1024  # Au-delà, le buffer passe sur disque (tempdir)
+TRANSCRIPT_GZIP = os.getenv("TRANSCRIPT_GZIP") == "1"
+# Archivage : pièces jointes téléchargées et zip (HTML + fichiers)
+TRANSCRIPT_ARCHIVE = os.getenv("TRANSCRIPT_ARCHIVE") == "1"
+ARCHIVE_DIR = "transcript_assets"  # Stockage adressé par contenu (sha256)
+ARCHIVE_CONCURRENCY = 4  # Téléchargements simultanés
+ARCHIVE_MAX_ATTACHMENT = 8 * 1024 * 1024  # Pièce jointe max archivée
+ARCHIVE_ASSETS_SHARE = 0.8  # Part de la limite d'upload pour les pièces jointes
+ARCHIVE_MAX_STORE = 2 * 1024 ** 3  # Taille max du stockage (octets)...
+ARCHIVE_MAX_AGE_DAYS = 30  # ...et âge max d'un fichier non réutilisé
+ARCHIVE_PRUNE_HOURS = 6  # Nettoyage périodique du stockage
+TRANSCRIPT_UPLOAD_MARGIN = 64 * 1024  # Marge sous guild.filesize_limit
+
+TRANSCRIPT_HEADER = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Transcript - {name}</title>
+    <style>
+        body {{ font-family: 'Segoe UI', sans-serif; background: #36393f; color: #dcddde; padding: 20px; }}
+        .message {{ display: flex; margin-bottom: 15px; }}
+        .avatar {{ width: 40px; height: 40px; border-radius: 50%; margin-right: 10px; }}
+        .content {{ flex: 1; }}
+        .author {{ font-weight: 600; color: #fff; }}
+        .timestamp {{ font-size: 0.75rem; color: #72767d; margin-left: 5px; }}
+        .text {{ margin-top: 2px; }}
+        a {{ color: #00aff4; }}
+    </style>
+</head>
+<body>
+    <h1>Transcript du ticket : {name}</h1>
+    <p><strong>Fermé le :</strong> {closed_at} UTC</p>
+    <hr>
+"""
+TRANSCRIPT_FOOTER = """</body>
+</html>
+"""
+
+
+def message_row(message):
+    # Données brutes extraites sur la boucle, le rendu HTML se fait dans un thread
+    author = message.author
+    return {
+        "author": author.display_name,
+        "avatar": (author.avatar or author.default_avatar).url,
+        "timestamp": message.created_at.strftime("%d/%m/%Y %H:%M:%S"),
+        "content": message.content or "",
+        "attachments": [(a.content_type, a.url, a.filename, a.size)
+                        for a in message.attachments],
+    }
+
+
+def render_message(row, assets=None):
+    attachments = ""
+    for content_type, url, *_ in row["attachments"]:
+        local = assets.get(url) if assets else None
+        is_image = content_type and content_type.startswith("image")
+        # Une pièce jointe retirée du zip retombe sur le lien CDN
+        if local and is_image:
+            attachments += (f'<br><img src="{local}" width="200" '
+                            f'onerror="this.onerror=null;this.src=\'{url}\'">')
+        elif local:
+            attachments += (f'<br><a href="{local}">[Fichier]</a> '
+                            f'<a href="{url}">[Lien d\'origine]</a>')
+        elif is_image:
+            attachments += f'<br><img src="{url}" width="200">'
+        else:
+            attachments += f'<br><a href="{url}">[Fichier]</a>'
+    content = html.escape(row["content"]).replace(chr(10), "<br>")
+    return ('<div class="message">'
+            f'<img src="{row["avatar"]}" class="avatar">'
             '<div class="content">'
-            f'<span class="author">{author}</span>'
-            f'<span class="timestamp">{timestamp}</span>'
-            f'<div class="text">{content.replace(chr(10), "<br>")}</div>'
+            f'<span class="author">{html.escape(row["author"])}</span>'
+            f'<span class="timestamp">{row["timestamp"]}</span>'
+            f'<div class="text">{content}</div>'
             f'{attachments}'
             '</div>'
-            '</div>')
-        messages.append(msg_html)
-
-    html_content = f"""\
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Transcript - {channel.name}</title>
-        <style>
-            body {{ font-family: 'Segoe UI', sans-serif; background: #36393f; color: #dcddde; padding: 20px; }}
-            .message {{ display: flex; margin-bottom: 15px; }}
-            .avatar {{ width: 40px; height: 40px; border-radius: 50%; margin-right: 10px; }}
-            .content {{ flex: 1; }}
-            .author {{ font-weight: 600; color: #fff; }}
-            .timestamp {{ font-size: 0.75rem; color: #72767d; margin-left: 5px; }}
-            .text {{ margin-top: 2px; }}
-            a {{ color: #00aff4; }}
-        </style>
-    </head>
-    <body>
-        <h1>Transcript du ticket : {channel.name}</h1>
-        <p><strong>Fermé le :</strong> {datetime.utcnow().strftime("%d/%m/%Y à %H:%M:%S")} UTC</p>
-        <hr>
-        {''.join(messages)}
-    </body>
-    </html>
-    """
-    filename = f"transcript-{channel.name}-{int(datetime.utcnow().timestamp())}.html"
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(textwrap.dedent(html_content))
-    return discord.File(filename, filename=filename)
+            '</div>\n')
+
+
+# ---------------------- REGISTRE DES TICKETS ----------------------
+# channel_id -> ticket et (guild_id, owner_id) -> channel_id. Persisté dans
+# TICKETS_FILE et recoupé au démarrage avec la catégorie des tickets.
+class TicketRegistry:
+
+    def __init__(self):
+        self.tickets = {}
+        self.owners = {}
+        self.locks = weakref.WeakValueDictionary()
+        self.save_lock = asyncio.Lock()
+
+    def load(self):
+        (path, ), seeded = state_paths(TICKETS_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        self.tickets = {int(cid): ticket for cid, ticket in data.items()
+                        if not seeded or hosts_guild(ticket["guild_id"])}
+        self.owners = {(t["guild_id"], t["owner_id"]): cid
+                       for cid, t in self.tickets.items()}
+
+    def rebuild(self, guild):
+        category = guild.get_channel(
+            guild_config.get(guild)["ticket_category_id"])
+        channels = ([c for c in category.text_channels
+                     if c.name.startswith("ticket-")]
+                    if isinstance(category, discord.CategoryChannel) else [])
+        alive = {c.id for c in channels}
+        for cid, ticket in list(self.tickets.items()):
+            if ticket["guild_id"] == guild.id and cid not in alive:
+                self.forget(cid)
+        for channel in channels:
+            if channel.id in self.tickets:
+                continue
+            members = [
+                target for target, overwrite in channel.overwrites.items()
+                if not isinstance(target, discord.Role)
+                and target.id != guild.me.id and overwrite.read_messages
+            ]
+            if not members:
+                continue
+            # Le salon est nommé ticket-<pseudo> du propriétaire
+            owner = next((m for m in members if getattr(m, "name", None)
+                          and channel.name == f"ticket-{m.name.lower()}"),
+                         members[0])
+            self.open(channel, owner.id, [m.id for m in members])
+
+    def get(self, channel_id):
+        return self.tickets.get(channel_id)
+
+    def channel_for(self, guild_id, owner_id):
+        return self.owners.get((guild_id, owner_id))
+
+    def lock_for(self, guild_id, owner_id):
+        lock = self.locks.get((guild_id, owner_id))
+        if lock is None:
+            lock = self.locks[(guild_id, owner_id)] = asyncio.Lock()
+        return lock
+
+    def open(self, channel, owner_id, participants=None):
+        self.tickets[channel.id] = {
+            "guild_id": channel.guild.id,
+            "owner_id": owner_id,
+            "status": "open",
+            "participants": participants or [owner_id],
+        }
+        self.owners[(channel.guild.id, owner_id)] = channel.id
+
+    def add_participant(self, channel_id, user_id):
+        ticket = self.tickets.get(channel_id)
+        if ticket and user_id not in ticket["participants"]:
+            ticket["participants"].append(user_id)
+
+    def set_status(self, channel_id, status):
+        ticket = self.tickets.get(channel_id)
+        if ticket:
+            ticket["status"] = status
+
+    def forget(self, channel_id):
+        ticket = self.tickets.pop(channel_id, None)
+        if ticket:
+            key = (ticket["guild_id"], ticket["owner_id"])
+            if self.owners.get(key) == channel_id:
+                del self.owners[key]
+        return ticket
+
+    async def save(self):
+        data = json.dumps({str(cid): t for cid, t in self.tickets.items()},
+                          indent=2)
+        async with self.save_lock:
+            await asyncio.to_thread(self._write, data)
+
+    def _write(self, data):
+        tmp = TICKETS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, TICKETS_FILE)
+
+
+ticket_registry = TicketRegistry()
+
+
+# ---------------------- CAPTURE DES TICKETS ----------------------
+# Les messages des tickets sont enregistrés au fil de l'eau : la fermeture
+# n'a plus qu'à rendre ce qui a déjà été capturé. Un ticket ouvert avant un
+# redémarrage est marqué incomplet et seul le début manquant est relu.
+class TicketLog:
+
+    def __init__(self, complete):
+        self.complete = complete
+        self.rows = {}  # message_id -> row, dans l'ordre d'arrivée
+
+
+ticket_logs = {}
+
+
+def is_ticket_channel(channel):
+    return ticket_registry.get(channel.id) is not None
+
+
+def capture_message(message):
+    log = ticket_logs.get(message.channel.id)
+    if log is None:
+        if not is_ticket_channel(message.channel):
+            return
+        log = ticket_logs[message.channel.id] = TicketLog(complete=False)
+    log.rows[message.id] = message_row(message)
+
+
+def capture_edit(payload):
+    log = ticket_logs.get(payload.channel_id)
+    row = log.rows.get(payload.message_id) if log else None
+    if row is None:
+        return
+    if "content" in payload.data:
+        row["content"] = payload.data["content"] or ""
+    if "attachments" in payload.data:
+        row["attachments"] = [(a.get("content_type"), a["url"],
+                               a.get("filename"), a.get("size", 0))
+                              for a in payload.data["attachments"]]
+
+
+def capture_delete(channel_id, message_ids):
+    log = ticket_logs.get(channel_id)
+    if log:
+        for message_id in message_ids:
+            log.rows.pop(message_id, None)
+
+
+async def transcript_rows(channel):
+    # Le journal n'est oublié qu'à la suppression du salon : une fermeture
+    # échouée peut être relancée
+    log = ticket_logs.get(channel.id)
+    if log is None or not log.complete:
+        # Backfill : uniquement les messages antérieurs à la capture
+        before = discord.Object(id=next(iter(log.rows))) if log and log.rows else None
+        async for message in channel.history(limit=None,
+                                             before=before,
+                                             oldest_first=True):
+            yield message_row(message)
+    if log:
+        for row in log.rows.values():
+            yield row
+
+
+class TranscriptWriter:
+
+    def __init__(self, compress=False):
+        self.buffer = tempfile.SpooledTemporaryFile(
+            max_size=TRANSCRIPT_SPOOL_SIZE)
+        self.stream = (gzip.GzipFile(fileobj=self.buffer, mode="wb")
+                       if compress else self.buffer)
+
+    def write(self, text):
+        self.stream.write(text.encode("utf-8"))
+
+    def write_rows(self, rows, assets=None):
+        self.write("".join(render_message(row, assets) for row in rows))
+
+    def size(self):
+        return self.buffer.tell()
+
+    def finish(self):
+        self.write(TRANSCRIPT_FOOTER)
+        if self.stream is not self.buffer:
+            self.stream.close()
+        self.buffer.seek(0)
+        return self.buffer
+
+    def close(self):
+        self.buffer.close()
+
+
+# ---------------------- ARCHIVAGE DES PIÈCES JOINTES ----------------------
+# Les liens du CDN Discord expirent : en mode archive, les pièces jointes
+# sont téléchargées (session HTTP partagée, concurrence bornée) dans un
+# stockage adressé par sha256, puis zippées avec le HTML. Une capture
+# d'écran postée plusieurs fois n'est stockée et zippée qu'une fois. Le
+# stockage est borné en âge et en taille (ARCHIVE_MAX_AGE_DAYS,
+# ARCHIVE_MAX_STORE) : les fichiers les moins récemment utilisés partent.
+class TranscriptTooLarge(Exception):
+    pass
+
+
+class AttachmentArchiver:
+
+    def __init__(self):
+        self.session = None
+        self.semaphore = asyncio.Semaphore(ARCHIVE_CONCURRENCY)
+
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=ARCHIVE_CONCURRENCY),
+                timeout=aiohttp.ClientTimeout(total=60))
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def path_for(self, digest, ext):
+        return os.path.join(ARCHIVE_DIR, digest[:2], digest + ext)
+
+    async def fetch(self, url, filename, size):
+        # Renvoie (chemin dans le stockage, taille) ou None
+        if size and size > ARCHIVE_MAX_ATTACHMENT:
+            return None
+        try:
+            async with self.semaphore:
+                async with self.session.get(url) as resp:
+                    if resp.status != 200 or (resp.content_length or 0) > ARCHIVE_MAX_ATTACHMENT:
+                        return None
+                    data = await resp.content.read(ARCHIVE_MAX_ATTACHMENT + 1)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Erreur archivage {filename}: {e}")
+            return None
+        if len(data) > ARCHIVE_MAX_ATTACHMENT:
+            return None
+        ext = os.path.splitext(filename or "")[1].lower()[:10]
+        path = await asyncio.to_thread(self._store, data, ext)
+        return path, len(data)
+
+    def _store(self, data, ext):
+        path = self.path_for(hashlib.sha256(data).hexdigest(), ext)
+        try:
+            # Réutilisé : rajeunit le fichier pour le nettoyage
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return path
+
+    def prune(self):
+        cutoff = time.time() - ARCHIVE_MAX_AGE_DAYS * 86400
+        files = []
+        for root, _, names in os.walk(ARCHIVE_DIR):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < cutoff:
+                    os.remove(path)
+                elif not name.endswith(".tmp"):
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= ARCHIVE_MAX_STORE:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+
+archiver = AttachmentArchiver()
+
+
+@tasks.loop(hours=ARCHIVE_PRUNE_HOURS)
+async def prune_transcript_assets():
+    try:
+        await asyncio.to_thread(archiver.prune)
+    except Exception as e:
+        print(f"Erreur nettoyage {ARCHIVE_DIR}: {e}")
+
+
+class TranscriptBundle:
+    # Limite d'upload par défaut des serveurs, sans size_limit
+    DEFAULT_LIMIT = 25 * 1024 * 1024
+
+    def __init__(self, size_limit=None):
+        self.writer = TranscriptWriter()
+        self.size_limit = size_limit
+        self.assets = {}  # chemin dans le stockage -> nom dans le zip
+        self.sizes = {}  # chemin dans le stockage -> taille
+        self.links = {}  # url CDN -> nom dans le zip
+        self.assets_size = 0
+
+    async def archive_rows(self, rows):
+        attachments = [a for row in rows for a in row["attachments"]
+                       if a[1] not in self.links]
+        results = await asyncio.gather(
+            *(archiver.fetch(url, filename, size)
+              for _, url, filename, size in attachments))
+        for (_, url, _, _), result in zip(attachments, results):
+            if result is None:
+                continue
+            path, size = result
+            if path not in self.assets:
+                # Au-delà de sa part de la limite, le lien CDN est conservé :
+                # le reste est réservé au HTML pas encore écrit
+                budget = (self.size_limit or self.DEFAULT_LIMIT
+                          ) * ARCHIVE_ASSETS_SHARE - self.writer.size()
+                if self.assets_size + size > budget:
+                    continue
+                self.assets[path] = "assets/" + os.path.basename(path)
+                self.sizes[path] = size
+                self.assets_size += size
+            self.links[url] = self.assets[path]
+        await asyncio.to_thread(self.writer.write_rows, rows, self.links)
+
+    def finish(self):
+        html_fp = self.writer.finish()
+        try:
+            bundle = self._zip(html_fp, self.assets)
+            size = file_size(bundle)
+            if self.size_limit is None or size <= self.size_limit:
+                return bundle
+            # Trop gros : les plus grosses pièces jointes sortent du zip
+            assets = dict(self.assets)
+            excess = size - self.size_limit
+            for path in sorted(assets, key=self.sizes.get, reverse=True):
+                if excess <= 0:
+                    break
+                del assets[path]
+                excess -= self.sizes[path]
+            bundle.close()
+            bundle = self._zip(html_fp, assets)
+            if file_size(bundle) > self.size_limit:
+                bundle.close()
+                raise TranscriptTooLarge(file_size(html_fp))
+            return bundle
+        finally:
+            html_fp.close()
+
+    def _zip(self, html_fp, assets):
+        html_fp.seek(0)
+        bundle = tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_SPOOL_SIZE)
+        with zipfile.ZipFile(bundle, "w", zipfile.ZIP_DEFLATED) as zf:
+            with zf.open("transcript.html", "w") as dest:
+                shutil.copyfileobj(html_fp, dest)
+            for path, arcname in assets.items():
+                try:
+                    zf.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+                except FileNotFoundError:
+                    # Retiré du stockage entre-temps : lien CDN en secours
+                    pass
+        bundle.seek(0)
+        return bundle
+
+    def close(self):
+        self.writer.close()
+
+
+def file_size(fp):
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    fp.seek(0)
+    return size
+
+
+def upload_limit(guild):
+    return guild.filesize_limit - TRANSCRIPT_UPLOAD_MARGIN
+
+
+async def generate_transcript(channel: discord.TextChannel,
+                              size_limit=None) -> discord.File:
+    # Lève TranscriptTooLarge si le fichier dépasse size_limit
+    start = time.perf_counter()
+    if TRANSCRIPT_ARCHIVE:
+        bundle = TranscriptBundle(size_limit)
+        writer = bundle.writer
+        write_rows = bundle.archive_rows
+    else:
+        bundle = None
+        writer = TranscriptWriter(compress=TRANSCRIPT_GZIP)
+
+        async def write_rows(rows):
+            await asyncio.to_thread(writer.write_rows, rows)
+
+    try:
+        writer.write(
+            TRANSCRIPT_HEADER.format(
+                name=html.escape(channel.name),
+                closed_at=datetime.utcnow().strftime("%d/%m/%Y à %H:%M:%S")))
+        rows = []
+        async for row in transcript_rows(channel):
+            rows.append(row)
+            if len(rows) >= TRANSCRIPT_CHUNK:
+                await write_rows(rows)
+                rows = []
+        if rows:
+            await write_rows(rows)
+        fp = await asyncio.to_thread(bundle.finish if bundle else writer.finish)
+    except BaseException:
+        writer.close()
+        raise
+    finally:
+        metrics.transcript.observe(time.perf_counter() - start)
+    if size_limit is not None and not bundle:
+        size = await asyncio.to_thread(file_size, fp)
+        if size > size_limit:
+            fp.close()
+            raise TranscriptTooLarge(size)
+    filename = f"transcript-{channel.name}-{int(datetime.utcnow().timestamp())}"
+    if bundle:
+        filename += ".zip"
+    else:
+        filename += ".html.gz" if TRANSCRIPT_GZIP else ".html"
+    # discord.File n'accepte que des io.IOBase : SpooledTemporaryFile n'en
+    # est un qu'à partir de Python 3.11, on passe donc le fichier sous-jacent
+    # (BytesIO ou fichier temporaire)
+    if not isinstance(fp, io.IOBase):
+        fp = fp._file
+    return discord.File(fp, filename=filename)
+
+
+# ---------------------- FILE D'ACTIONS ----------------------
+# Les commandes répondent d'abord à l'interaction puis déposent ici leurs
+# effets de bord (DM, logs, rôles). Les actions sont exécutées par priorité,
+# avec une concurrence limitée par route et des retries sur erreur 5xx.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+RETRYABLE_ERRORS = (discord.DiscordServerError, aiohttp.ClientError,
+                    asyncio.TimeoutError, OSError)
+
+
+class ActionQueue:
+
+    def __init__(self, workers=ACTION_WORKERS):
+        self.queue = asyncio.PriorityQueue()
+        self.counter = itertools.count()
+        self.routes = {
+            route: asyncio.Semaphore(limit)
+            for route, limit in ACTION_ROUTE_LIMITS.items()
+        }
+        self.size = workers
+        self.workers = []
+
+    def start(self):
+        if not self.workers:
+            self.workers = [
+                asyncio.create_task(self._worker()) for _ in range(self.size)
+            ]
+
+    def submit(self,
+               route,
+               factory,
+               priority=PRIORITY_NORMAL,
+               attempt=0,
+               handler=None):
+        # factory : fonction sans argument qui renvoie la coroutine à exécuter
+        self.queue.put_nowait((priority, next(self.counter), route, factory,
+                               attempt, handler or current_handler.get()))
+
+    def depth(self):
+        return self.queue.qsize()
+
+    async def drain(self, timeout=10):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"File d'actions non vidée : {self.depth()} action(s)")
+
+    async def _worker(self):
+        while True:
+            priority, _, route, factory, attempt, handler = await self.queue.get()
+            current_handler.set(handler)
+            try:
+                await self._run(priority, route, factory, attempt, handler)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, priority, route, factory, attempt, handler):
+        semaphore = self.routes.setdefault(route, asyncio.Semaphore(1))
+        try:
+            async with semaphore:
+                await factory()
+        except (discord.Forbidden, discord.NotFound):
+            pass
+        except RETRYABLE_ERRORS as e:
+            if attempt < ACTION_RETRIES:
+                asyncio.get_running_loop().call_later(
+                    2**attempt, self.submit, route, factory, priority,
+                    attempt + 1, handler)
+            else:
+                print(f"Action {route} abandonnée : {e}")
+        except Exception as e:
+            print(f"Erreur action {route}: {e}")
+
+
+action_queue = ActionQueue()
+
+
+# ---------------------- LOGS GROUPÉS ----------------------
+# Les embeds de logs sont regroupés par salon : un seul message (jusqu'à 10
+# embeds, EMBED_MAX_CHARS caractères) part après LOG_SINK_WINDOW secondes ou
+# dès que le lot est plein. Au-delà de LOG_SINK_MAX_PENDING embeds en
+# attente, emit() bloque.
+def shorten(text, limit):
+    return text if len(text) <= limit else text[:max(limit - 1, 0)] + "…"
+
+
+def fit_embed(embed):
+    """Tronque un embed trop long : un 400 ferait perdre tout le lot."""
+    if embed.description and len(embed.description) > 4096:
+        embed.description = shorten(embed.description, 4096)
+    for i, field in enumerate(embed.fields):
+        if len(field.value) > 1024:
+            embed.set_field_at(i, name=field.name,
+                               value=shorten(field.value, 1024),
+                               inline=field.inline)
+    excess = len(embed) - EMBED_MAX_CHARS
+    if excess > 0 and embed.description:
+        embed.description = shorten(embed.description,
+                                    max(len(embed.description) - excess, 1))
+    fields = sorted(enumerate(embed.fields), key=lambda f: -len(f[1].value))
+    for i, field in fields:
+        excess = len(embed) - EMBED_MAX_CHARS
+        if excess <= 0:
+            break
+        embed.set_field_at(i, name=field.name,
+                           value=shorten(field.value,
+                                         max(len(field.value) - excess, 1)),
+                           inline=field.inline)
+    return embed
+
+
+class LogSink:
+
+    def __init__(self):
+        self.buffers = {}
+        self.sizes = {}  # Caractères des embeds en attente, par salon
+        self.channels = {}
+        self.timers = {}
+        self.slots = {}
+
+    async def emit(self, channel, embed):
+        slots = self.slots.setdefault(
+            channel.id, asyncio.Semaphore(LOG_SINK_MAX_PENDING))
+        await slots.acquire()
+        self.channels[channel.id] = channel
+        size = len(fit_embed(embed))
+        if self.sizes.get(channel.id, 0) + size > EMBED_MAX_CHARS:
+            self.flush(channel.id)
+        buffer = self.buffers.setdefault(channel.id, [])
+        buffer.append(embed)
+        self.sizes[channel.id] = self.sizes.get(channel.id, 0) + size
+        if len(buffer) >= 10:
+            self.flush(channel.id)
+        elif channel.id not in self.timers:
+            self.timers[channel.id] = asyncio.get_running_loop().call_later(
+                LOG_SINK_WINDOW, self.flush, channel.id)
+
+    def pending(self):
+        return sum(len(b) for b in list(self.buffers.values()))
+
+    def flush(self, channel_id):
+        timer = self.timers.pop(channel_id, None)
+        if timer:
+            timer.cancel()
+        batch = self.buffers.pop(channel_id, None)
+        self.sizes.pop(channel_id, None)
+        if not batch:
+            return
+        channel = self.channels[channel_id]
+        slots = self.slots[channel_id]
+        released = False
+
+        async def send():
+            nonlocal released
+            try:
+                await channel.send(embeds=batch)
+            finally:
+                # Les retries ne rendent pas les places une seconde fois
+                if not released:
+                    released = True
+                    for _ in batch:
+                        slots.release()
+
+        action_queue.submit("log", send, PRIORITY_LOW)
+
+    def flush_all(self):
+        for channel_id in list(self.buffers):
+            self.flush(channel_id)
+
+
+log_sink = LogSink()
+
+
+# ---------------------- RÔLE MUTED ----------------------
+# Les overwrites du rôle Muted sont vérifiées sur le cache et seules les
+# manquantes sont appliquées, en tâche de fond et en parallèle borné
+# (discord.py attend lui-même les buckets de rate limit).
+MUTED_PERMISSIONS = {
+    "send_messages": False,
+    "speak": False,
+    "add_reactions": False
+}
+muted_sync_tasks = {}
+
+
+def muted_overwrite_ok(channel, role):
+    overwrite = channel.overwrites_for(role)
+    return all(
+        getattr(overwrite, perm) is value
+        for perm, value in MUTED_PERMISSIONS.items())
+
+
+async def apply_muted_overwrite(channel, role, semaphore=None):
+    overwrite = channel.overwrites_for(role)
+    overwrite.update(**MUTED_PERMISSIONS)
+    try:
+        if semaphore is None:
+            await channel.set_permissions(role, overwrite=overwrite)
+        else:
+            async with semaphore:
+                await channel.set_permissions(role, overwrite=overwrite)
+    except discord.HTTPException as e:
+        print(f"Erreur overwrite Muted sur {channel.name}: {e}")
+        return False
+    return True
+
+
+async def sync_muted_overwrites(guild, role):
+    missing = [c for c in guild.channels if not muted_overwrite_ok(c, role)]
+    if not missing:
+        return 0
+    semaphore = asyncio.Semaphore(MUTE_SYNC_CONCURRENCY)
+    results = await asyncio.gather(
+        *(apply_muted_overwrite(c, role, semaphore) for c in missing))
+    return sum(results)
+
+
+def ensure_muted_sync(guild, role):
+    task = muted_sync_tasks.get(guild.id)
+    if task and not task.done():
+        return task
+    task = asyncio.create_task(sync_muted_overwrites(guild, role))
+    muted_sync_tasks[guild.id] = task
+    return task
+
+
+async def get_muted_role(guild):
+    muted_role = discord.utils.get(guild.roles, name=MUTED_ROLE_NAME)
+    if not muted_role:
+        muted_role = await guild.create_role(name=MUTED_ROLE_NAME,
+                                             reason="Rôle pour mute")
+        ensure_muted_sync(guild, muted_role)
+    return muted_role
+
+
+# ---------------------- SANCTIONS TEMPORAIRES ----------------------
+# Un seul tas (échéance, action) et une seule tâche qui dort jusqu'à la
+# prochaine échéance. Comme les warns, persisté par un journal append-only
+# (SANCTIONS_JOURNAL) compacté dans SANCTIONS_FILE : après un redémarrage,
+# les actions échues sont exécutées immédiatement.
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "j": 86400, "d": 86400}
+INVALID_DURATION = "Durée invalide (ex : 10m, 2h, 7j)."
+
+
+def parse_duration(value):
+    value = value.lower().replace(" ", "")
+    if not re.fullmatch(r"(\d+[smhjd])+", value):
+        raise ValueError(value)
+    duration = timedelta(seconds=sum(
+        int(amount) * DURATION_UNITS[unit]
+        for amount, unit in re.findall(r"(\d+)([smhjd])", value)))
+    if not duration:
+        # "0m" ne doit pas devenir une sanction permanente
+        raise ValueError(value)
+    return duration
+
+
+def sanction_target(action):
+    return (action["type"], action.get("guild_id"), str(action["user_id"]))
+
+
+class SanctionScheduler:
+
+    def __init__(self):
+        self.actions = {}  # id -> action
+        self.heap = []  # (échéance epoch, seq, id), entrées annulées comprises
+        self.targets = {}  # (type, guild_id, user_id) -> {id}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        self.task = None
+
+    def load(self):
+        (snapshot, journal), seeded = state_paths(SANCTIONS_FILE,
+                                                  SANCTIONS_JOURNAL)
+        try:
+            with open(snapshot, "r", encoding="utf-8") as f:
+                actions = json.load(f)
+        except FileNotFoundError:
+            actions = []
+        self.actions, self.heap, self.targets = {}, [], {}
+        for action in actions:
+            # Les anciens fichiers n'ont pas d'identifiant : dérivé du contenu
+            # pour que le journal puisse y faire référence
+            action.setdefault("id", hashlib.sha256(json.dumps(
+                action, sort_keys=True).encode()).hexdigest()[:16])
+            self._add(action)
+        self.pending = 0
+        try:
+            with open(journal, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Dernière ligne tronquée par un arrêt brutal
+                        continue
+                    # Rejouer deux fois un enregistrement est sans effet
+                    if record["op"] == "add":
+                        self._discard(record["action"]["id"])
+                        self._add(record["action"])
+                    else:
+                        for action_id in record["ids"]:
+                            self._discard(action_id)
+                    self.pending += 1
+        except FileNotFoundError:
+            pass
+        if seeded:
+            # Première exécution du groupe de shards : ses propres fichiers
+            for action in list(self.actions.values()):
+                if not hosts_guild(action.get("guild_id", HOME_GUILD_ID)):
+                    self._discard(action["id"])
+            self._write_snapshot(list(self.actions.values()))
+            self.pending = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def _add(self, action):
+        self.actions[action["id"]] = action
+        entry = (action["due"], next(self.counter), action["id"])
+        heapq.heappush(self.heap, entry)
+        self.targets.setdefault(sanction_target(action),
+                                set()).add(action["id"])
+        return entry
+
+    def _discard(self, action_id):
+        action = self.actions.pop(action_id, None)
+        if action is None:
+            return None
+        key = sanction_target(action)
+        ids = self.targets.get(key)
+        if ids is not None:
+            ids.discard(action_id)
+            if not ids:
+                del self.targets[key]
+        return action
+
+    async def schedule(self, delay, action):
+        action["id"] = os.urandom(8).hex()
+        action["due"] = time.time() + delay.total_seconds()
+        entry = self._add(action)
+        if self.heap[0] is entry:
+            self.wakeup.set()
+        await self._journal({"op": "add", "action": action})
+
+    async def cancel(self, type, guild_id, user_id):
+        ids = self.targets.pop((type, guild_id, str(user_id)), None)
+        if not ids:
+            return
+        for action_id in ids:
+            self.actions.pop(action_id, None)
+        # Les entrées annulées restent dans le tas jusqu'à leur échéance
+        if len(self.heap) > 2 * len(self.actions) + 64:
+            self.heap = [e for e in self.heap if e[2] in self.actions]
+            heapq.heapify(self.heap)
+        await self._journal({"op": "done", "ids": sorted(ids)})
+
+    async def adopt_legacy(self, guild_id):
+        # Échéances de warns enregistrées avant le découpage par serveur
+        for action in list(self.actions.values()):
+            if action["type"] == "expire_warn" and "guild_id" not in action:
+                self._discard(action["id"])
+                action["guild_id"] = guild_id
+                self._add(action)
+                await self._journal({"op": "add", "action": action})
+
+    async def _journal(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        async with self.lock:
+            await asyncio.to_thread(self._append, line)
+            self.pending += 1
+            if self.pending >= SANCTIONS_COMPACT_EVERY:
+                await self._compact()
+
+    def _append(self, line):
+        with open(SANCTIONS_JOURNAL, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def compact(self):
+        async with self.lock:
+            if self.pending:
+                await self._compact()
+
+    async def _compact(self):
+        await asyncio.to_thread(self._write_snapshot,
+                                list(self.actions.values()))
+        self.pending = 0
+
+    def _write_snapshot(self, actions):
+        tmp = SANCTIONS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(actions, f)
+        os.replace(tmp, SANCTIONS_FILE)
+        open(SANCTIONS_JOURNAL, "w", encoding="utf-8").close()
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            due, _, action_id = self.heap[0]
+            if action_id not in self.actions:
+                heapq.heappop(self.heap)
+                continue
+            delay = due - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            action = self.actions[action_id]
+            guild_id = action.get("guild_id", HOME_GUILD_ID)
+            if not hosts_guild(guild_id):
+                # Serveur d'un autre processus : l'action reste telle quelle
+                continue
+            if action["type"] != "expire_warn" and bot.get_guild(
+                    guild_id) is None:
+                # Serveur indisponible ou pas encore en cache : jamais
+                # marquée comme faite sans avoir été exécutée
+                heapq.heappush(self.heap,
+                               (time.time() + SANCTION_RETRY_SECONDS,
+                                next(self.counter), action_id))
+                continue
+            self._discard(action_id)
+            try:
+                await run_scheduled_action(action)
+            except Exception as e:
+                print(f"Erreur sanction programmée {action['type']}: {e}")
+            await self._journal({"op": "done", "ids": [action_id]})
+
+
+sanction_scheduler = SanctionScheduler()
+
+
+async def run_scheduled_action(action):
+    if action["type"] == "expire_warn":
+        # Les échéances d'avant le découpage par serveur n'ont pas de guild_id
+        await warn_store.remove(action.get("guild_id", HOME_GUILD_ID),
+                                action["user_id"], action["timestamp"])
+        return
+    guild = bot.get_guild(action["guild_id"])
+    if guild is None:
+        return
+    if action["type"] == "unban":
+        try:
+            await guild.unban(discord.Object(id=action["user_id"]),
+                              reason="Fin du ban temporaire")
+        except discord.NotFound:
+            pass
+    elif action["type"] == "unmute":
+        muted_role = discord.utils.get(guild.roles, name=MUTED_ROLE_NAME)
+        if muted_role is None:
+            return
+        try:
+            member = guild.get_member(
+                action["user_id"]) or await guild.fetch_member(
+                    action["user_id"])
+        except discord.NotFound:
+            return
+        if member.get_role(muted_role.id):
+            action_queue.submit(
+                "roles", lambda: member.remove_roles(
+                    muted_role, reason="Fin du mute temporaire"),
+                PRIORITY_HIGH)
+
+
+# ---------------------- SANCTIONS ----------------------
+# Chemins communs aux commandes et à l'automod.
+async def apply_mute(guild, member, reason, duration=None):
+    muted_role = await get_muted_role(guild)
+    if member.get_role(muted_role.id):
+        return False
+    # Un unmute programmé par un mute précédent ne doit pas lever celui-ci
+    await sanction_scheduler.cancel(type="unmute",
+                                    guild_id=guild.id,
+                                    user_id=member.id)
+    action_queue.submit("roles",
+                        lambda: member.add_roles(muted_role, reason=reason),
+                        PRIORITY_HIGH)
+    if duration:
+        await sanction_scheduler.schedule(duration, {
+            "type": "unmute",
+            "guild_id": guild.id,
+            "user_id": member.id
+        })
+    return True
+
+
+async def apply_ban(guild, user, reason, duration=None):
+    await sanction_scheduler.cancel(type="unban",
+                                    guild_id=guild.id,
+                                    user_id=user.id)
+    await guild.ban(user, reason=reason)
+    if duration:
+        await sanction_scheduler.schedule(duration, {
+            "type": "unban",
+            "guild_id": guild.id,
+            "user_id": user.id
+        })
+
+
+async def apply_warn(guild, user, moderator, reason, duration=None,
+                     automatic=False):
+    # Les warns de l'automod ne comptent pas pour les sanctions automatiques
+    timestamp = datetime.utcnow().isoformat()
+    entry = {
+        "reason": reason,
+        "moderator": str(moderator),
+        "timestamp": timestamp
+    }
+    if automatic:
+        entry["automod"] = True
+    await warn_store.add(guild.id, user.id, entry)
+    if duration is None and WARN_EXPIRY_DAYS:
+        duration = timedelta(days=WARN_EXPIRY_DAYS)
+    if duration:
+        await sanction_scheduler.schedule(duration, {
+            "type": "expire_warn",
+            "guild_id": guild.id,
+            "user_id": str(user.id),
+            "timestamp": timestamp
+        })
+    action_queue.submit(
+        "dm", lambda: user.send(
+            f"Tu as reçu un warn sur **{guild.name}**.\n**Raison** : {reason}"
+        ), PRIORITY_LOW)
+    # Renvoie la sanction automatique appliquée, ou None
+    sanction = None if automatic else await apply_warn_thresholds(guild, user)
+    log_channel = get_channel_by_name(guild,
+                                      guild_config.get(guild)["log_channel"])
+    if log_channel:
+        embed = discord.Embed(title="Nouveau Warn",
+                              color=discord.Color.orange())
+        embed.add_field(name="Utilisateur", value=user.mention, inline=False)
+        embed.add_field(name="Modérateur",
+                        value=moderator.mention,
+                        inline=False)
+        embed.add_field(name="Raison", value=reason, inline=False)
+        if sanction:
+            embed.add_field(name="Sanction automatique",
+                            value=sanction,
+                            inline=False)
+        embed.set_footer(text=f"ID: {user.id}")
+        await log_sink.emit(log_channel, embed)
+    return sanction
+
+
+def parse_warn_thresholds(entries):
+    """[(warns, fenêtre, sanction, durée ou None, libellé)], ValueError sinon."""
+    thresholds = []
+    for entry in entries:
+        count = entry["warns"]
+        if (not isinstance(count, int) or count < 1
+                or entry["sanction"] not in ("mute", "ban")):
+            raise ValueError(f"seuil invalide : {entry}")
+        label = entry.get("duration")
+        duration = parse_duration(label) if label else None
+        thresholds.append((count, parse_duration(entry["window"]),
+                           entry["sanction"], duration, label or "permanent"))
+    return sorted(thresholds, key=lambda t: t[0], reverse=True)
+
+
+async def apply_warn_thresholds(guild, user):
+    # Seuil le plus élevé atteint exactement par ce warn
+    try:
+        thresholds = parse_warn_thresholds(
+            guild_config.get(guild)["warn_thresholds"])
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Erreur warn_thresholds ({guild.id}): {e}")
+        return None
+    for count, window, sanction, duration, label in thresholds:
+        if warn_store.recent_count(guild.id, user.id, window) != count:
+            continue
+        reason = f"Sanction automatique : {count} warns"
+        try:
+            if sanction == "ban":
+                await apply_ban(guild, user, reason, duration)
+            elif not isinstance(user, discord.Member) or not await apply_mute(
+                    guild, user, reason, duration):
+                return None
+        except discord.HTTPException as e:
+            print(f"Erreur sanction automatique: {e}")
+            return None
+        return f"{sanction.capitalize()} ({label}) : {count} warns"
+    return None
+
+
+# ---------------------- AUTOMOD ----------------------
+# Coût constant par message : compteurs de débit dans des deques de taille
+# fixe, empreintes des derniers messages, et un automate Aho-Corasick unique
+# pour tous les mots interdits. Les utilisateurs inactifs sont évincés.
+class KeywordMatcher:
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]  # Longueurs des mots qui se terminent sur ce nœud
+        for word in words:
+            node = 0
+            for char in word.lower():
+                nxt = self.goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            self.out[node] += (len(word), )
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self.goto[node].items():
+                queue.append(nxt)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                if self.fail[nxt] == nxt:
+                    self.fail[nxt] = 0
+                self.out[nxt] += self.out[self.fail[nxt]]
+
+    def find(self, text):
+        # Premier mot interdit trouvé en mot entier, sinon None
+        text = text.lower()
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in out[node]:
+                start = i - length + 1
+                if ((start == 0 or not text[start - 1].isalnum()) and
+                    (i + 1 == len(text) or not text[i + 1].isalnum())):
+                    return text[start:i + 1]
+        return None
+
+
+class UserActivity:
+    __slots__ = ("times", "fingerprints", "last_seen")
+
+    def __init__(self):
+        self.times = deque(maxlen=AUTOMOD_RATE_COUNT)
+        self.fingerprints = deque(maxlen=AUTOMOD_DUPLICATE_HISTORY)
+        self.last_seen = 0.0
+
+
+class AutoMod:
+
+    def __init__(self):
+        self.matchers = {}  # guild_id -> KeywordMatcher ou None
+        self.users = OrderedDict()  # (guild_id, user_id) -> UserActivity
+
+    def matcher_for(self, guild):
+        if guild.id not in self.matchers:
+            words = guild_config.get(guild)["automod_banned_words"]
+            self.matchers[guild.id] = KeywordMatcher(words) if words else None
+        return self.matchers[guild.id]
+
+    def _activity(self, key, now):
+        activity = self.users.get(key)
+        if activity is None:
+            activity = self.users[key] = UserActivity()
+        else:
+            self.users.move_to_end(key)
+        activity.last_seen = now
+        # Éviction en tête : le plus ancien accès est toujours le premier
+        while self.users and (len(self.users) > AUTOMOD_MAX_USERS or
+                              now - next(iter(self.users.values())).last_seen
+                              > AUTOMOD_IDLE_SECONDS):
+            self.users.popitem(last=False)
+        return activity
+
+    def check(self, message):
+        # Renvoie (action, raison) ou None
+        now = time.monotonic()
+        activity = self._activity((message.guild.id, message.author.id), now)
+        activity.times.append(now)
+        if (len(activity.times) == AUTOMOD_RATE_COUNT
+                and now - activity.times[0] < AUTOMOD_RATE_WINDOW):
+            activity.times.clear()
+            return "mute", "AutoMod : flood"
+        content = message.content
+        if not content:
+            return None
+        matcher = self.matcher_for(message.guild)
+        if matcher:
+            word = matcher.find(content)
+            if word:
+                return "warn", f"AutoMod : mot interdit ({word})"
+        normalized = " ".join(content.lower().split())
+        if len(normalized) < AUTOMOD_DUPLICATE_MIN_LENGTH:
+            return None
+        fingerprint = hash(normalized)
+        repeats = 1 + sum(
+            1 for seen, previous in activity.fingerprints
+            if previous == fingerprint
+            and now - seen < AUTOMOD_DUPLICATE_WINDOW)
+        activity.fingerprints.append((now, fingerprint))
+        if repeats >= AUTOMOD_DUPLICATE_COUNT:
+            activity.fingerprints.clear()
+            return "warn", "AutoMod : messages répétés"
+        return None
+
+
+automod = AutoMod()
+
+
+async def run_automod(message):
+    if (not AUTOMOD_ENABLED or message.guild is None
+            or not isinstance(message.author, discord.Member)
+            or member_has_group(message.guild, message.author, "authorized")):
+        return False
+    result = automod.check(message)
+    if result is None:
+        return False
+    action, reason = result
+    if action == "mute":
+        await apply_mute(message.guild, message.author, reason,
+                         AUTOMOD_MUTE_DURATION)
+    else:
+        action_queue.submit("messages", message.delete, PRIORITY_HIGH)
+        await apply_warn(message.guild, message.author, message.guild.me,
+                         reason, automatic=True)
+    return True
+
+
+# ---------------------- INDEX DES BANS ----------------------
+# Liste des bans chargée une fois par serveur (au premier /unban ou à la
+# première autocomplétion) puis tenue à jour par les events ban/unban.
+def ban_display_name(user):
+    return f"{user.name}#{user.discriminator}" if user.discriminator != "0" else user.name
+
+
+class BanIndex:
+
+    def __init__(self):
+        self.guilds = {}  # guild_id -> {"users": {id: user}, "names": [(nom, id)]}
+        self.warming = {}
+        # Bans et débans reçus pendant le chargement, rejoués ensuite
+        self.buffered = {}  # guild_id -> [(user, None) ou (None, user_id)]
+
+    async def _warm(self, guild):
+        entry = {"users": {}, "names": []}
+        self.buffered[guild.id] = []
+        try:
+            async for ban_entry in guild.bans(limit=None):
+                entry["users"][ban_entry.user.id] = ban_entry.user
+        except BaseException:
+            self.buffered.pop(guild.id, None)
+            raise
+        entry["names"] = sorted((ban_display_name(u).lower(), uid)
+                                for uid, u in entry["users"].items())
+        self.guilds[guild.id] = entry
+        for user, user_id in self.buffered.pop(guild.id):
+            if user is not None:
+                self.add(guild, user)
+            else:
+                self.remove(guild, user_id)
+
+    async def ensure(self, guild):
+        if guild.id in self.guilds:
+            return
+        task = self.warming.get(guild.id)
+        if task is None or task.done():
+            task = self.warming[guild.id] = asyncio.create_task(
+                self._warm(guild))
+        await asyncio.shield(task)
+
+    def warm_in_background(self, guild):
+        task = self.warming.get(guild.id)
+        if guild.id not in self.guilds and (task is None or task.done()):
+            self.warming[guild.id] = asyncio.create_task(self._warm(guild))
+
+    def add(self, guild, user):
+        entry = self.guilds.get(guild.id)
+        if entry is None:
+            if guild.id in self.buffered:
+                self.buffered[guild.id].append((user, None))
+            return
+        if user.id in entry["users"]:
+            return
+        entry["users"][user.id] = user
+        bisect.insort(entry["names"], (ban_display_name(user).lower(), user.id))
+
+    def remove(self, guild, user_id):
+        entry = self.guilds.get(guild.id)
+        if entry is None:
+            if guild.id in self.buffered:
+                self.buffered[guild.id].append((None, user_id))
+            return
+        user = entry["users"].pop(user_id, None)
+        if user is not None:
+            key = (ban_display_name(user).lower(), user_id)
+            i = bisect.bisect_left(entry["names"], key)
+            if i < len(entry["names"]) and entry["names"][i] == key:
+                del entry["names"][i]
+
+    def find(self, guild, name):
+        entry = self.guilds.get(guild.id)
+        if entry is None:
+            return None
+        key = name.lower()
+        names = entry["names"]
+        i = bisect.bisect_left(names, (key, 0))
+        if i < len(names) and names[i][0] == key:
+            return entry["users"][names[i][1]]
+        return None
+
+    def search(self, guild, prefix, limit=25):
+        entry = self.guilds.get(guild.id)
+        if entry is None:
+            return []
+        prefix = prefix.lower()
+        names = entry["names"]
+        results = []
+        i = bisect.bisect_left(names, (prefix, 0))
+        while i < len(names) and len(results) < limit:
+            name, user_id = names[i]
+            if not name.startswith(prefix):
+                break
+            results.append(entry["users"][user_id])
+            i += 1
+        return results
+
+
+ban_index = BanIndex()
+
+
+# ---------------------- SYNCHRO DES COMMANDES ----------------------
+# tree.sync() n'est appelé que si l'empreinte des commandes a changé depuis
+# la dernière synchronisation réussie.
+def command_fingerprint(guild=None):
+    payload = sorted((c.to_dict(tree) for c in tree.get_commands(guild=guild)),
+                     key=lambda c: (c.get("type", 1), c["name"]))
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_sync_state():
+    try:
+        with open(COMMAND_SYNC_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_sync_state(state):
+    with open(COMMAND_SYNC_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+
+async def sync_commands():
+    state = await asyncio.to_thread(load_sync_state)
+    targets = [("global", None)]
+    if SYNC_GUILD_IDS:
+        targets = []
+        for guild_id in SYNC_GUILD_IDS:
+            guild = discord.Object(id=guild_id)
+            tree.copy_global_to(guild=guild)
+            targets.append((f"guild:{guild_id}", guild))
+    changed = False
+    for key, guild in targets:
+        fingerprint = command_fingerprint(guild)
+        if state.get(key) == fingerprint:
+            print(f"Commandes slash déjà à jour ({key}).")
+            continue
+        await tree.sync(guild=guild)
+        state[key] = fingerprint
+        changed = True
+        print(f"Commandes slash synchronisées ({key}).")
+    if changed:
+        await asyncio.to_thread(save_sync_state, state)
 
 
 # ---------------------- EVENTS ----------------------
+startup_reported = False
+
+
 @bot.event
 async def on_ready():
     print(f"Connecté en tant que {bot.user}")
-    try:
-        await tree.sync()
-        print("Commandes slash synchronisées.")
-    except Exception as e:
-        print(f"Erreur de sync: {e}")
+    global startup_reported
+    if not startup_reported:
+        startup_reported = True
+        startup_report()
+    legacy = warn_store.legacy_count()
+    if legacy:
+        # Warns sans serveur et HOME_GUILD_ID non défini : rattachés au seul
+        # serveur du bot, sinon on refuse de tourner sans eux
+        if len(bot.guilds) != 1:
+            print(f"{legacy} warns sans serveur et {len(bot.guilds)} "
+                  "serveurs : définir HOME_GUILD_ID. Arrêt.")
+            await bot.close()
+            return
+        await warn_store.adopt_legacy(bot.guilds[0].id)
+        await sanction_scheduler.adopt_legacy(bot.guilds[0].id)
+        print(f"{legacy} warns rattachés au serveur {bot.guilds[0].name}.")
+    for guild in bot.guilds:
+        ticket_registry.rebuild(guild)
+        role_index.build(guild)
+        muted_role = discord.utils.get(guild.roles, name=MUTED_ROLE_NAME)
+        if muted_role:
+            ensure_muted_sync(guild, muted_role)
+    await ticket_registry.save()
+    await role_index.save()
+    # Après on_ready : les serveurs sont en cache pour rattraper les échéances
+    sanction_scheduler.start()
+
+
+@bot.event
+async def on_shard_connect(shard_id):
+    gateway_state[shard_id] = (True, time.monotonic())
+
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    gateway_state[shard_id] = (True, time.monotonic())
+
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    gateway_state[shard_id] = (False, time.monotonic())
+
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction,
+                                    command):
+    started = interaction.extras.get("started")
+    if started is not None:
+        metrics.observe("command", command.qualified_name,
+                        time.perf_counter() - started)
 
 
 @bot.event
 async def on_message(message):
+    capture_message(message)
     if message.author.bot:
         return
+    if await run_automod(message):
+        return
     if bot.user in message.mentions:
         await message.add_reaction("wave")
     await bot.process_commands(message)
 
 
+@bot.event
+async def on_raw_message_edit(payload):
+    capture_edit(payload)
+
+
+@bot.event
+async def on_raw_message_delete(payload):
+    capture_delete(payload.channel_id, [payload.message_id])
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    capture_delete(payload.channel_id, payload.message_ids)
+
+
+@bot.event
+async def on_member_ban(guild, user):
+    ban_index.add(guild, user)
+
+
+@bot.event
+async def on_member_unban(guild, user):
+    ban_index.remove(guild, user.id)
+
+
+@bot.event
+async def on_guild_role_create(role):
+    role_index.add_role(role)
+    await role_index.save()
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    # Un renommage ne retire jamais un rôle déjà indexé
+    if before.name != after.name:
+        role_index.add_role(after)
+        await role_index.save()
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    role_index.remove_role(role)
+    await role_index.save()
+
+
+@bot.event
+async def on_guild_channel_create(channel):
+    channel_index.add_channel(channel)
+    muted_role = discord.utils.get(channel.guild.roles, name=MUTED_ROLE_NAME)
+    if muted_role and not muted_overwrite_ok(channel, muted_role):
+        await apply_muted_overwrite(channel, muted_role)
+
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    if isinstance(after, discord.TextChannel) and before.name != after.name:
+        channel_index.rename_channel(before, after)
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    if isinstance(channel, discord.TextChannel):
+        channel_index.remove_channel(channel)
+    ticket_logs.pop(channel.id, None)
+    if ticket_registry.forget(channel.id):
+        await ticket_registry.save()
+
+
 # ---------------------- COMMANDES MODÉRATION ----------------------
 @tree.command(name="kick", description="Expulse un membre du serveur.")
 @is_authorized()
@@ -197,13 +2699,24 @@ async def kick(interaction: discord.Interaction,
 
 @tree.command(name="ban", description="Bannit un membre du serveur.")
 @is_authorized()
-@app_commands.describe(user="Utilisateur à bannir", reason="Raison du ban")
+@app_commands.describe(user="Utilisateur à bannir",
+                       reason="Raison du ban",
+                       duration="Durée (ex : 30m, 12h, 7j), permanent sinon")
 async def ban(interaction: discord.Interaction,
               user: discord.Member,
-              reason: str = "Aucune raison"):
-    await user.ban(reason=reason)
+              reason: str = "Aucune raison",
+              duration: str = None):
+    try:
+        delay = parse_duration(duration) if duration else None
+    except ValueError:
+        await interaction.response.send_message(INVALID_DURATION,
+                                                ephemeral=True)
+        return
+    await apply_ban(interaction.guild, user, reason, delay)
+    suffix = f" pour {duration}" if delay else ""
     await interaction.response.send_message(
-        f"{user.mention} a été banni. Raison : {reason}", ephemeral=True)
+        f"{user.mention} a été banni{suffix}. Raison : {reason}",
+        ephemeral=True)
 
 
 @tree.command(name="unban",
@@ -216,6 +2729,9 @@ async def unban(interaction: discord.Interaction, name: str):
         user_id = int(name)
         user = await bot.fetch_user(user_id)
         await interaction.guild.unban(discord.Object(id=user_id))
+        await sanction_scheduler.cancel(type="unban",
+                                        guild_id=interaction.guild.id,
+                                        user_id=user_id)
         await interaction.followup.send(f"{user} (`{user_id}`) a été débanni.")
         return
     except ValueError:
@@ -223,67 +2739,187 @@ async def unban(interaction: discord.Interaction, name: str):
     except discord.NotFound:
         await interaction.followup.send("Aucun ban trouvé pour cet ID.")
         return
-    bans = await interaction.guild.bans()
-    for ban_entry in bans:
-        user = ban_entry.user
-        full = f"{user.name}#{user.discriminator}" if user.discriminator != "0" else user.name
-        if name.lower() in [full.lower(), str(user.id)]:
-            await interaction.guild.unban(user)
-            await interaction.followup.send(f"{user.mention} a été débanni.")
-            return
+    await ban_index.ensure(interaction.guild)
+    user = ban_index.find(interaction.guild, name)
+    if user:
+        await interaction.guild.unban(user)
+        await sanction_scheduler.cancel(type="unban",
+                                        guild_id=interaction.guild.id,
+                                        user_id=user.id)
+        await interaction.followup.send(f"{user.mention} a été débanni.")
+        return
     await interaction.followup.send(
         "Aucun utilisateur correspondant trouvé dans les bans.")
 
 
+@unban.autocomplete("name")
+async def unban_autocomplete(interaction: discord.Interaction, current: str):
+    # Les checks de la commande ne s'appliquent pas à l'autocomplétion
+    if not member_in_group(interaction, "authorized"):
+        return []
+    if interaction.guild.id not in ban_index.guilds:
+        # Pas d'attente ici : l'autocomplétion doit répondre tout de suite
+        ban_index.warm_in_background(interaction.guild)
+        return []
+    return [
+        app_commands.Choice(name=f"{ban_display_name(u)} ({u.id})"[:100],
+                            value=str(u.id))
+        for u in ban_index.search(interaction.guild, current)
+    ]
+
+
 @tree.command(name="clear", description="Supprime un nombre de messages.")
 @is_authorized()
-@app_commands.describe(amount="Nombre de messages à supprimer (1-100)")
-async def clear(interaction: discord.Interaction, amount: int):
-    if amount < 1 or amount > 100:
-        await interaction.response.send_message("Entre 1 et 100 messages.",
+@app_commands.describe(
+    amount=f"Nombre de messages à supprimer (1-{CLEAR_MAX}, "
+    f"dont {CLEAR_OLD_MAX} de plus de 14 jours)",
+    user="Seulement les messages de cet utilisateur",
+    bots="Seulement les messages des bots",
+    contains="Seulement les messages contenant ce texte",
+    before="ID du message avant lequel supprimer",
+    after="ID du message après lequel supprimer")
+async def clear(interaction: discord.Interaction,
+                amount: app_commands.Range[int, 1, CLEAR_MAX],
+                user: discord.Member = None,
+                bots: bool = False,
+                contains: str = None,
+                before: str = None,
+                after: str = None):
+    try:
+        before = discord.Object(id=int(before)) if before else None
+        after = discord.Object(id=int(after)) if after else None
+    except ValueError:
+        await interaction.response.send_message("ID de message invalide.",
                                                 ephemeral=True)
         return
-    await interaction.channel.purge(limit=amount + 1)
-    await interaction.response.send_message(f"{amount} messages supprimés.",
-                                            ephemeral=True)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    channel = interaction.channel
+    contains = contains.lower() if contains else None
+
+    def eligible(message):
+        if user and message.author.id != user.id:
+            return False
+        if bots and not message.author.bot:
+            return False
+        if contains and contains not in message.content.lower():
+            return False
+        return True
+
+    # Les messages de plus de 14 jours ne peuvent pas être supprimés en masse
+    bulk_cutoff = discord.utils.utcnow() - timedelta(days=14, minutes=-1)
+    deleted = 0
+    scanned = 0
+    skipped = 0
+    batch = []
+    old = []
+    progress = await interaction.followup.send("Suppression en cours...",
+                                               ephemeral=True,
+                                               wait=True)
+    progress_deadline = interaction.created_at + timedelta(
+        minutes=CLEAR_PROGRESS_MINUTES)
+
+    async def report(done=False):
+        nonlocal progress
+        state = "terminée" if done else "en cours"
+        content = (f"Suppression {state} : {deleted}/{amount} messages "
+                   f"supprimés ({scanned} analysés).")
+        if skipped:
+            content += (f" Messages de plus de 14 jours ignorés au-delà "
+                        f"de {CLEAR_OLD_MAX}.")
+        if progress is not None and discord.utils.utcnow() < progress_deadline:
+            try:
+                await progress.edit(content=content)
+                return
+            except discord.HTTPException:
+                progress = None
+        # Jeton expiré : le bilan final est posté dans le salon
+        if done:
+            await channel.send(f"{interaction.user.mention} {content}",
+                               allowed_mentions=discord.AllowedMentions(
+                                   users=[interaction.user]))
+
+    async def flush():
+        nonlocal deleted, batch
+        if batch:
+            await channel.delete_messages(batch)
+            deleted += len(batch)
+            batch = []
+            await report()
+
+    async for message in channel.history(limit=CLEAR_SCAN_LIMIT,
+                                         before=before,
+                                         after=after):
+        scanned += 1
+        if not eligible(message):
+            continue
+        if message.created_at > bulk_cutoff:
+            batch.append(message)
+            if len(batch) == 100:
+                await flush()
+        elif len(old) < CLEAR_OLD_MAX:
+            old.append(message)
+        else:
+            skipped += 1
+            # Du plus récent au plus ancien : tout le reste est trop vieux
+            if after is None:
+                break
+        if deleted + len(batch) + len(old) >= amount:
+            break
+    await flush()
+    for i, message in enumerate(old, 1):
+        try:
+            await message.delete()
+            deleted += 1
+        except discord.NotFound:
+            pass
+        if i % 10 == 0:
+            await report()
+        await asyncio.sleep(CLEAR_OLD_DELETE_DELAY)
+    await report(done=True)
 
 
 @tree.command(name="mute", description="Rend un utilisateur muet.")
 @is_authorized()
-@app_commands.describe(user="Utilisateur à mute", reason="Raison du mute")
+@app_commands.describe(user="Utilisateur à mute",
+                       reason="Raison du mute",
+                       duration="Durée (ex : 10m, 2h, 1j), permanent sinon")
 async def mute(interaction: discord.Interaction,
                user: discord.Member,
-               reason: str = "Aucune raison"):
-    muted_role = discord.utils.get(interaction.guild.roles, name="Muted")
-    if not muted_role:
-        muted_role = await interaction.guild.create_role(
-            name="Muted", reason="Rôle pour mute")
-    for channel in interaction.guild.channels:
-        await channel.set_permissions(muted_role,
-                                      send_messages=False,
-                                      speak=False,
-                                      add_reactions=False)
-    if muted_role in user.roles:
+               reason: str = "Aucune raison",
+               duration: str = None):
+    try:
+        delay = parse_duration(duration) if duration else None
+    except ValueError:
+        await interaction.response.send_message(INVALID_DURATION,
+                                                ephemeral=True)
+        return
+    if not await apply_mute(interaction.guild, user, reason, delay):
         await interaction.response.send_message(
             f"{user.mention} est déjà muté.", ephemeral=True)
         return
-    await user.add_roles(muted_role, reason=reason)
+    suffix = f" pour {duration}" if delay else ""
     await interaction.response.send_message(
-        f"{user.mention} a été muté. Raison : {reason}", ephemeral=True)
+        f"{user.mention} a été muté{suffix}. Raison : {reason}",
+        ephemeral=True)
 
 
 @tree.command(name="unmute", description="Démute un utilisateur.")
 @is_authorized()
 @app_commands.describe(user="Utilisateur à démute")
 async def unmute(interaction: discord.Interaction, user: discord.Member):
-    muted_role = discord.utils.get(interaction.guild.roles, name="Muted")
+    muted_role = discord.utils.get(interaction.guild.roles,
+                                   name=MUTED_ROLE_NAME)
     if not muted_role or muted_role not in user.roles:
         await interaction.response.send_message(
             "Cet utilisateur n'est pas muté.", ephemeral=True)
         return
-    await user.remove_roles(muted_role)
     await interaction.response.send_message(f"{user.mention} a été démute.",
                                             ephemeral=True)
+    action_queue.submit("roles", lambda: user.remove_roles(muted_role),
+                        PRIORITY_HIGH)
+    await sanction_scheduler.cancel(type="unmute",
+                                    guild_id=interaction.guild.id,
+                                    user_id=user.id)
 
 
 # ---------------------- LOCK / UNLOCK ----------------------
@@ -317,7 +2953,7 @@ async def unlock(interaction: discord.Interaction,
 @has_ticket_permission()
 @app_commands.describe(user="Utilisateur à ajouter")
 async def add_user(interaction: discord.Interaction, user: discord.Member):
-    if not interaction.channel.name.startswith("ticket-"):
+    if ticket_registry.get(interaction.channel.id) is None:
         await interaction.response.send_message(
             "Cette commande ne peut être utilisée que dans un ticket.",
             ephemeral=True)
@@ -332,6 +2968,8 @@ async def add_user(interaction: discord.Interaction, user: discord.Member):
                                               send_messages=True,
                                               attach_files=True,
                                               read_message_history=True)
+    ticket_registry.add_participant(interaction.channel.id, user.id)
+    await ticket_registry.save()
     await interaction.response.send_message(
         f"{user.mention} a été ajouté au ticket.", ephemeral=True)
     await interaction.channel.send(
@@ -347,39 +2985,57 @@ class TicketView(View):
     @discord.ui.button(label="Ouvrir un ticket",
                        style=discord.ButtonStyle.success,
                        custom_id="open_ticket")
+    @instrumented("button", "open_ticket")
     async def open_ticket(self, interaction: discord.Interaction,
                           button: discord.ui.Button):
         guild = interaction.guild
-        overwrites = {
-            guild.default_role:
-            discord.PermissionOverwrite(read_messages=False),
-            interaction.user:
-            discord.PermissionOverwrite(read_messages=True, send_messages=True)
-        }
-        # Ajouter le rôle Recruteur par ID
-        recruiter_role = guild.get_role(RECRUITER_ROLE_ID)
-        if recruiter_role:
-            overwrites[recruiter_role] = discord.PermissionOverwrite(
-                read_messages=True, send_messages=True)
-
-        # Récupérer la catégorie par ID
-        category = guild.get_channel(TICKET_CATEGORY_ID)
-        if not category or not isinstance(category, discord.CategoryChannel):
-            await interaction.response.send_message(
-                "Erreur : catégorie de tickets introuvable.", ephemeral=True)
-            return
-
-        ticket_channel = await guild.create_text_channel(
-            f"ticket-{interaction.user.name}",
-            category=category,
-            overwrites=overwrites)
+        # Un double clic attend le premier et retombe sur le même ticket
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        async with ticket_registry.lock_for(guild.id, interaction.user.id):
+            existing = guild.get_channel(
+                ticket_registry.channel_for(guild.id, interaction.user.id) or 0)
+            if existing:
+                await interaction.followup.send(
+                    f"Tu as déjà un ticket ouvert : {existing.mention}",
+                    ephemeral=True)
+                return
+            overwrites = {
+                guild.default_role:
+                discord.PermissionOverwrite(read_messages=False),
+                interaction.user:
+                discord.PermissionOverwrite(read_messages=True,
+                                            send_messages=True)
+            }
+            # Ajouter le rôle Recruteur par ID
+            config = guild_config.get(guild)
+            recruiter_role = guild.get_role(config["recruiter_role_id"])
+            if recruiter_role:
+                overwrites[recruiter_role] = discord.PermissionOverwrite(
+                    read_messages=True, send_messages=True)
+
+            # Récupérer la catégorie par ID
+            category = guild.get_channel(config["ticket_category_id"])
+            if not category or not isinstance(category,
+                                              discord.CategoryChannel):
+                await interaction.followup.send(
+                    "Erreur : catégorie de tickets introuvable.",
+                    ephemeral=True)
+                return
+
+            ticket_channel = await guild.create_text_channel(
+                f"ticket-{interaction.user.name}",
+                category=category,
+                overwrites=overwrites)
+            ticket_registry.open(ticket_channel, interaction.user.id)
+            ticket_logs[ticket_channel.id] = TicketLog(complete=True)
+        await ticket_registry.save()
         view = CloseTicketView()
         message = (
-            f"Bonjour {interaction.user.mention}, un <@&{RECRUITER_ROLE_ID}> va s'occuper de toi.\n"
+            f"Bonjour {interaction.user.mention}, un <@&{config['recruiter_role_id']}> va s'occuper de toi.\n"
             "Pour faciliter la gestion, merci de **fournir un screen de ton profil en jeu**"
         )
         await ticket_channel.send(message, view=view)
-        await interaction.response.send_message(
+        await interaction.followup.send(
             f"Ton ticket a été créé : {ticket_channel.mention}",
             ephemeral=True)
 
@@ -392,29 +3048,55 @@ class CloseTicketView(View):
     @discord.ui.button(label="Fermer le ticket",
                        style=discord.ButtonStyle.red,
                        custom_id="close_ticket")
+    @instrumented("button", "close_ticket")
     async def close_ticket(self, interaction: discord.Interaction,
                            button: discord.ui.Button):
+        ticket = ticket_registry.get(interaction.channel.id)
+        if ticket and ticket["status"] == "closing":
+            await interaction.response.send_message(
+                "Fermeture du ticket déjà en cours.", ephemeral=True)
+            return
+        ticket_registry.set_status(interaction.channel.id, "closing")
         await interaction.response.send_message(
             "Fermeture du ticket dans 5 secondes...", ephemeral=True)
         await asyncio.sleep(5)
+        config = guild_config.get(interaction.guild)
         log_channel = get_channel_by_name(interaction.guild,
-                                          TICKET_LOG_CHANNEL)
+                                          config["ticket_log_channel"])
         if log_channel:
-            await log_channel.send(
-                f"Ticket fermé : `{interaction.channel.name}` par {interaction.user.mention}"
-            )
-        transcript_channel = get_channel_by_name(interaction.guild,
-                                                 TRANSCRIPT_CHANNEL)
+            embed = discord.Embed(title="Ticket fermé",
+                                  color=discord.Color.red())
+            embed.add_field(name="Ticket",
+                            value=f"`{interaction.channel.name}`",
+                            inline=False)
+            embed.add_field(name="Fermé par",
+                            value=interaction.user.mention,
+                            inline=False)
+            await log_sink.emit(log_channel, embed)
+        transcript_channel = (log_channel if config["transcript_channel"]
+                              == config["ticket_log_channel"] else
+                              get_channel_by_name(interaction.guild,
+                                                  config["transcript_channel"]))
         if transcript_channel:
             try:
-                transcript_file = await generate_transcript(interaction.channel
-                                                            )
-                await transcript_channel.send(
-                    f"Transcript du ticket `{interaction.channel.name}`",
-                    file=transcript_file)
-                os.remove(transcript_file.filename)
+                transcript_file = await generate_transcript(
+                    interaction.channel, upload_limit(interaction.guild))
+                try:
+                    await transcript_channel.send(
+                        f"Transcript du ticket `{interaction.channel.name}`",
+                        file=transcript_file)
+                finally:
+                    transcript_file.fp.close()
             except Exception as e:
-                print(f"Erreur transcript: {e}")
+                # Sans transcript, le ticket n'est pas supprimé
+                print(f"Erreur transcript: {e!r}")
+                ticket_registry.set_status(interaction.channel.id, "open")
+                reason = ("transcript trop volumineux"
+                          if isinstance(e, TranscriptTooLarge) else
+                          "erreur lors du transcript")
+                await interaction.channel.send(
+                    f"Fermeture annulée ({reason}) : le ticket est conservé.")
+                return
         await interaction.channel.delete()
 
 
@@ -437,65 +3119,205 @@ async def ticketpanel(interaction: discord.Interaction,
 # ---------------------- WARN SYSTEM ----------------------
 @tree.command(name="warn", description="Warn un membre avec une raison.")
 @has_warn_role()
-@app_commands.describe(user="Utilisateur à warn", reason="Raison du warn")
-async def warn(interaction: discord.Interaction, user: discord.Member,
-               reason: str):
+@app_commands.describe(user="Utilisateur à warn",
+                       reason="Raison du warn",
+                       duration="Expiration du warn (ex : 30j)")
+async def warn(interaction: discord.Interaction,
+               user: discord.Member,
+               reason: str,
+               duration: str = None):
     try:
-        await user.send(
-            f"Tu as reçu un warn sur **{interaction.guild.name}**.\n**Raison** : {reason}"
-        )
-    except discord.Forbidden:
-        pass
-    log_channel = get_channel_by_name(interaction.guild, LOG_CHANNEL_NAME)
-    if log_channel:
-        embed = discord.Embed(title="Nouveau Warn",
-                              color=discord.Color.orange())
-        embed.add_field(name="Utilisateur", value=user.mention, inline=False)
-        embed.add_field(name="Modérateur",
-                        value=interaction.user.mention,
-                        inline=False)
-        embed.add_field(name="Raison", value=reason, inline=False)
-        embed.set_footer(text=f"ID: {user.id}")
-        await log_channel.send(embed=embed)
-    warns = load_warns()
-    user_id = str(user.id)
-    if user_id not in warns:
-        warns[user_id] = []
-    warns[user_id].append({
-        "reason": reason,
-        "moderator": str(interaction.user),
-        "timestamp": datetime.utcnow().isoformat()
-    })
-    save_warns(warns)
+        delay = parse_duration(duration) if duration else None
+    except ValueError:
+        await interaction.response.send_message(INVALID_DURATION,
+                                                ephemeral=True)
+        return
     await interaction.response.send_message(
         f"{user.mention} a été warn. Log envoyé.", ephemeral=True)
+    sanction = await apply_warn(interaction.guild, user, interaction.user,
+                                reason, delay)
+    if sanction:
+        await interaction.followup.send(
+            f"Sanction automatique pour {user.mention} : {sanction}",
+            ephemeral=True)
+
+
+WARNS_PAGE_SIZE = 5
+
+
+def warn_field_value(user_id, w, show_user):
+    ts = datetime.fromisoformat(w["timestamp"].split('.')[0])
+    timestamp = int(ts.timestamp())
+    user = f"**Membre** : <@{user_id}>\n" if show_user else ""
+    return f"{user}**Modérateur** : {w['moderator']}\n**Raison** : {w['reason']}\n**Date** : <t:{timestamp}:R>"
+
+
+class WarnsPager(View):
+    # Seule la page affichée est lue dans l'index, du plus récent au plus ancien.
+    # source() renvoie (total, fetch), fetch(lo, hi) les éléments [lo, hi) en
+    # ordre chronologique. Relue à chaque page : les warns ont pu changer.
+
+    def __init__(self, author_id, title, source, show_user=False):
+        super().__init__(timeout=180)
+        self.author_id = author_id
+        self.title = title
+        self.source = source
+        self.show_user = show_user
+        self.page = 0
+        self.refresh()
+
+    def refresh(self):
+        self.total, self.fetch = self.source()
+        self.pages = max(1, -(-self.total // WARNS_PAGE_SIZE))
+        self.page = min(self.page, self.pages - 1)
+        self.update_buttons()
+
+    def embed(self):
+        hi = self.total - self.page * WARNS_PAGE_SIZE
+        lo = max(0, hi - WARNS_PAGE_SIZE)
+        embed = discord.Embed(title=self.title, color=discord.Color.orange())
+        for i, (user_id, w) in enumerate(reversed(self.fetch(lo, hi))):
+            embed.add_field(name=f"Warn {self.total - self.page * WARNS_PAGE_SIZE - i}",
+                            value=warn_field_value(user_id, w,
+                                                   self.show_user),
+                            inline=False)
+        embed.set_footer(
+            text=f"Page {self.page + 1}/{self.pages} • {self.total} warn(s)")
+        return embed
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.author_id
+
+    async def show(self, interaction):
+        self.refresh()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction,
+                            button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await self.show(interaction)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction,
+                        button: discord.ui.Button):
+        self.page += 1
+        await self.show(interaction)
+
+
+async def send_warns_pager(interaction, pager):
+    await interaction.response.send_message(
+        embed=pager.embed(),
+        view=pager if pager.pages > 1 else discord.utils.MISSING,
+        ephemeral=True)
 
 
 @tree.command(name="warns", description="Voir les warns d'un membre")
 @has_warn_role()
 @app_commands.describe(user="Membre à vérifier")
 async def warns_cmd(interaction: discord.Interaction, user: discord.Member):
-    warns = load_warns()
-    user_warns = warns.get(str(user.id), [])
+    guild_id = interaction.guild.id
+    user_warns = warn_store.get(guild_id, user.id)
     if not user_warns:
         await interaction.response.send_message(
             f"{user.mention} n'a aucun warn.", ephemeral=True)
         return
-    embed = discord.Embed(title=f"Warns de {user}",
+    user_id = str(user.id)
+
+    def source():
+        user_warns = warn_store.get(guild_id, user_id)
+        return len(user_warns), lambda lo, hi: [(user_id, w)
+                                                for w in user_warns[lo:hi]]
+
+    pager = WarnsPager(interaction.user.id, f"Warns de {user}", source)
+    await send_warns_pager(interaction, pager)
+
+
+warnsearch = app_commands.Group(name="warnsearch",
+                                description="Rechercher dans les warns")
+
+
+@warnsearch.command(name="moderateur",
+                    description="Warns donnés par un modérateur")
+@has_warn_role()
+@app_commands.describe(moderator="Modérateur")
+async def warnsearch_moderator(interaction: discord.Interaction,
+                               moderator: discord.Member):
+    index = warn_store.index(interaction.guild.id)
+    if not index.by_moderator.get(str(moderator)):
+        await interaction.response.send_message(
+            f"Aucun warn donné par {moderator.mention}.", ephemeral=True)
+        return
+
+    def source():
+        entries = index.by_moderator.get(str(moderator), [])
+        return len(entries), lambda lo, hi: entries[lo:hi]
+
+    pager = WarnsPager(interaction.user.id, f"Warns donnés par {moderator}",
+                       source, show_user=True)
+    await send_warns_pager(interaction, pager)
+
+
+@warnsearch.command(name="periode", description="Warns sur une période")
+@has_warn_role()
+@app_commands.describe(start="Date de début (JJ/MM/AAAA)",
+                       end="Date de fin incluse (JJ/MM/AAAA), aujourd'hui sinon")
+async def warnsearch_period(interaction: discord.Interaction,
+                            start: str,
+                            end: str = None):
+    try:
+        since = datetime.strptime(start, "%d/%m/%Y")
+        until = (datetime.strptime(end, "%d/%m/%Y")
+                 if end else datetime.utcnow()) + timedelta(days=1)
+    except ValueError:
+        await interaction.response.send_message(
+            "Date invalide (format JJ/MM/AAAA).", ephemeral=True)
+        return
+    until_label = "aujourd'hui"
+    index = warn_store.index(interaction.guild.id)
+    lo, hi = index.time_range(since, until)
+    if lo >= hi:
+        await interaction.response.send_message(
+            "Aucun warn sur cette période.", ephemeral=True)
+        return
+
+    def source():
+        lo, hi = index.time_range(since, until)
+        by_time = index.by_time
+        return max(0, hi - lo), lambda a, b: [
+            (uid, w) for _, uid, w in by_time[lo + a:lo + b]]
+
+    pager = WarnsPager(interaction.user.id,
+                       f"Warns du {start} au {end or until_label}", source,
+                       show_user=True)
+    await send_warns_pager(interaction, pager)
+
+
+@warnsearch.command(name="top", description="Membres les plus warn")
+@has_warn_role()
+@app_commands.describe(limit="Nombre de membres (1-25)")
+async def warnsearch_top(interaction: discord.Interaction,
+                         limit: app_commands.Range[int, 1, 25] = 10):
+    top = warn_store.index(interaction.guild.id).top_offenders(limit)
+    if not top:
+        await interaction.response.send_message("Aucun warn enregistré.",
+                                                ephemeral=True)
+        return
+    embed = discord.Embed(title="Membres les plus warn",
+                          description="\n".join(
+                              f"**{i}.** <@{uid}> : {count} warn(s)"
+                              for i, (count, uid) in enumerate(top, 1)),
                           color=discord.Color.orange())
-    for i, w in enumerate(user_warns[-5:], 1):
-        ts = datetime.fromisoformat(w["timestamp"].split('.')[0])
-        timestamp = int(ts.timestamp())
-        embed.add_field(
-            name=f"Warn {i}",
-            value=
-            f"**Modérateur** : {w['moderator']}\n**Raison** : {w['reason']}\n**Date** : <t:{timestamp}:R>",
-            inline=False)
-    if len(user_warns) > 5:
-        embed.set_footer(text=f"... et {len(user_warns) - 5} autre(s)")
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
+tree.add_command(warnsearch)
+
+
 # --- /embed (avec preview) ---
 @bot.tree.command(name="embed", description="Créer un embed personnalisé avec preview avant envoi")
 @app_commands.describe(title="Titre de l'embed", description="Contenu de l'embed", color_hex="Couleur (hex, ex: #ff0000)")
@@ -525,9 +3347,30 @@ async def embed(interaction: discord.Interaction, title: str, description: str,
 
     await interaction.followup.send("Souhaites-tu envoyer cet embed ?", view=view, ephemeral=True)
 
+# ---------------------- CONFIG ----------------------
+@tree.command(name="reloadconfig",
+              description="Recharge la configuration des serveurs")
+@is_authorized()
+async def reloadconfig(interaction: discord.Interaction):
+    if await guild_config.reload(force=True):
+        await interaction.response.send_message(
+            "Configuration rechargée.", ephemeral=True)
+    else:
+        await interaction.response.send_message(
+            f"Erreur dans `{GUILD_CONFIG_FILE}` ({guild_config.error}), "
+            "configuration inchangée.",
+            ephemeral=True)
+
+
 # ---------------------- ERREURS ----------------------
 @tree.error
 async def on_app_command_error(interaction: discord.Interaction, error):
+    if interaction.command:
+        name = interaction.command.qualified_name
+        metrics.error("command", name)
+        started = interaction.extras.get("started")
+        if started is not None:
+            metrics.observe("command", name, time.perf_counter() - started)
     if isinstance(error, app_commands.errors.CheckFailure):
         await interaction.response.send_message("Tu n’as pas la permission.",
                                                 ephemeral=True)
@@ -536,5 +3379,10 @@ async def on_app_command_error(interaction: discord.Interaction, error):
 
 
 # ---------------------- LANCEMENT ----------------------
-keep_alive()
-bot.run(TOKEN)
+if __name__ == "__main__":
+    guild_config.load()
+    warn_store.load()
+    ticket_registry.load()
+    role_index.load()
+    sanction_scheduler.load()
+    bot.run(TOKEN)